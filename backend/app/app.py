@@ -1,10 +1,11 @@
-import time
+import secrets
+import threading
 from flask import Flask
+from flask_migrate import Migrate
 from config import Config
-from models import db, User
-from routes.routes_users import bp_users
-from routes.routes_files import bp_files
-from werkzeug.security import generate_password_hash
+from models import db
+from metrics import init_metrics
+from startup import prepare_database
 import os
 from dotenv import load_dotenv
 
@@ -15,25 +16,38 @@ load_dotenv(dotenv_path)
 DEFAULT_USER = os.getenv('DEFAULT_USER')
 DEFAULT_PASSWORD = os.getenv('DEFAULT_PASSWORD')
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+migrate = Migrate()
+
 def create_app():
+    """Build the app without touching the database; servers then call startup.prepare_database"""
     app = Flask(__name__)
     app.config.from_object(Config)
-    
-    try:
-        db.init_app(app)
-        with app.app_context():
-            # Introduce a delay to ensure DB is fully set up
-            time.sleep(5)  # Delay in seconds
-            db.create_all()
-            print("Veritabanı bağlantısı başarılı ve tablolar oluşturuldu.")
-            
-    except Exception as e:
-        print(f"Veritabanına bağlanırken hata oluştu: {e}")
+    if not app.config['SECRET_KEY']:
+        # Tokens signed by one worker must verify in the others: no per-process key
+        if not app.debug:
+            raise RuntimeError('SECRET_KEY is not set; it signs the session tokens of every worker')
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+        app.logger.warning('SECRET_KEY is not set: development key, session tokens end with this process')
+    init_metrics(app)
+
+    db.init_app(app)
+    # SQLite can only change columns by rebuilding the table, hence batch mode
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+    # Set once the database answers and its schema is current (see startup.py)
+    app.extensions['database_ready'] = threading.Event()
 
+    # The route modules pull in most of the app; imported here rather than with this module
+    from routes.routes_users import bp_users
+    from routes.routes_files import bp_files
     app.register_blueprint(bp_users, url_prefix='/api')
     app.register_blueprint(bp_files)
     return app
 
 if __name__ == '__main__':
+    # Development server, single process
+    os.environ.setdefault('FLASK_DEBUG', '1')
     app = create_app()
+    prepare_database(app)
+    print("Veritabanı bağlantısı başarılı ve şema güncel.")
     app.run(host='0.0.0.0', port=5000, debug=True)
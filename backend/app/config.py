@@ -13,7 +13,45 @@ class Config:
     POSTGRES_HOST=os.getenv('POSTGRES_HOST')
     POSTGRES_DATABASE=os.getenv('POSTGRES_DATABASE')
     
-    SQLALCHEMY_DATABASE_URI = (
+    # DATABASE_URL lets local runs point at another database (e.g. sqlite:///tree.db)
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or (
         f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}"
     )
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool of each worker process. Size workers so that
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) + 1 listener each stays under max_connections.
+    # Only Postgres gets a QueuePool; SQLite keeps SQLAlchemy's default pool.
+    if SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+            # Connections dropped by the server or a proxy are replaced instead of failing a request
+            'pool_pre_ping': True,
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+            'connect_args': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                # Milliseconds, 0 disables it; migrations and imports use DB_BULK_STATEMENT_TIMEOUT_MS
+                'options': f"-c statement_timeout={int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))}",
+            },
+        }
+
+    # statement_timeout (milliseconds, 0 disables it) of the migration transaction and of
+    # /files/import, which rewrite or load whole tables; Postgres only
+    DB_BULK_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_BULK_STATEMENT_TIMEOUT_MS', '0'))
+
+    # Startup: how long to retry an unreachable database, and whether to apply the
+    # migrations (flask db upgrade) before reporting ready
+    DB_STARTUP_TIMEOUT = int(os.getenv('DB_STARTUP_TIMEOUT', '60'))
+    MIGRATE_ON_START = os.getenv('MIGRATE_ON_START', 'true').lower() == 'true'
+
+    # Signs the session tokens of /api/auth/login; every worker must share it
+    SECRET_KEY = os.getenv('SECRET_KEY')
+    SESSION_TOKEN_SECONDS = int(os.getenv('SESSION_TOKEN_SECONDS', '43200'))
+    # Threads hashing passwords in each worker, and how many hashes may wait for one
+    PASSWORD_HASH_THREADS = int(os.getenv('PASSWORD_HASH_THREADS', '2'))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '16'))
+
+    # Requests slower than this are logged with their SQL statements; 0 disables the log
+    SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '0'))
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from models import db
+
+# Request instrumentation exported in Prometheus text format on /metrics.
+# Every worker process keeps its own registry; Prometheus sums them per scrape target.
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+BYTE_BUCKETS = (1000, 10000, 100000, 1000000, 10000000, 100000000)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+# Statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per label set"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts, total = self.series.get(labels, ([0] * len(self.buckets), [0, 0.0]))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        total[0] += 1
+        total[1] += value
+        self.series[labels] = (counts, total)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, (count, value_sum)) in sorted(self.series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(labels, le=bound)} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {value_sum}')
+            lines.append(f'{self.name}_count{_labels(labels)} {count}')
+        return lines
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+_lock = threading.Lock()
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements per request.', QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS)
+REQUEST_ROWS = Histogram('http_request_rows_loaded', 'ORM rows loaded per request.', ROW_BUCKETS)
+REQUEST_BYTES = Histogram('http_response_bytes', 'Response body size.', BYTE_BUCKETS)
+POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection.', WAIT_BUCKETS)
+HISTOGRAMS = [
+    REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, REQUEST_ROWS, REQUEST_BYTES, POOL_WAIT_SECONDS,
+]
+_pool_timeouts = 0
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited and how many timed out"""
+
+    def connect(self):
+        global _pool_timeouts
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with _lock:
+                _pool_timeouts += 1
+            raise
+        finally:
+            with _lock:
+                POOL_WAIT_SECONDS.observe((), time.perf_counter() - started)
+
+def _current():
+    """Return the metrics of the request being served, or None outside requests"""
+    if has_app_context():
+        return g.get('request_metrics')
+    return None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    metrics = _current()
+    if metrics is None:
+        return
+    metrics['queries'] += 1
+    metrics['db_seconds'] += elapsed
+    if len(metrics['statements']) < MAX_LOGGED_QUERIES:
+        metrics['statements'].append((elapsed, statement))
+
+@event.listens_for(db.Model, 'load', propagate=True)
+def _on_load(target, context):
+    metrics = _current()
+    if metrics is not None:
+        metrics['rows'] += 1
+
+def _count_bytes(body, metrics):
+    """Pass a streamed body through while adding up its size"""
+    for chunk in body:
+        metrics['bytes'] += len(chunk)
+        yield chunk
+
+def _start_request():
+    g.request_metrics = {
+        'started': time.perf_counter(),
+        'queries': 0,
+        'db_seconds': 0.0,
+        'rows': 0,
+        'bytes': 0,
+        'status': 500,
+        'statements': [],
+    }
+
+def _finish_response(response):
+    metrics = _current()
+    if metrics is not None:
+        metrics['status'] = response.status_code
+        if response.is_streamed:
+            response.response = _count_bytes(response.response, metrics)
+        else:
+            metrics['bytes'] = response.calculate_content_length() or 0
+    return response
+
+def _record_request(exc):
+    """Record the request once it is fully served, after any streamed body"""
+    metrics = _current()
+    if metrics is None:
+        return
+    elapsed = time.perf_counter() - metrics['started']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('method', request.method), ('route', route), ('status', metrics['status']))
+    route_labels = (('route', route),)
+
+    with _lock:
+        REQUEST_SECONDS.observe(labels, elapsed)
+        REQUEST_QUERIES.observe(route_labels, metrics['queries'])
+        REQUEST_DB_SECONDS.observe(route_labels, metrics['db_seconds'])
+        REQUEST_ROWS.observe(route_labels, metrics['rows'])
+        REQUEST_BYTES.observe(route_labels, metrics['bytes'])
+
+    slow_ms = current_app.config.get('SLOW_REQUEST_MS')
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        statements = '\n'.join(
+            f'  {seconds * 1000:.1f} ms  {" ".join(statement.split())}'
+            for seconds, statement in metrics['statements']
+        )
+        logger.warning(
+            f"Slow request {request.method} {request.path}: {elapsed * 1000:.1f} ms, "
+            f"{metrics['queries']} queries, {metrics['db_seconds'] * 1000:.1f} ms in SQL\n{statements}"
+        )
+
+def _gauge(name, help_text, value, kind='gauge'):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+def _pool_lines():
+    """Current state of this worker's connection pool, when it is a QueuePool"""
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        return []
+    return (
+        _gauge('db_pool_size', 'Connections kept open by the pool.', pool.size())
+        + _gauge('db_pool_checked_out', 'Connections in use.', pool.checkedout())
+        + _gauge('db_pool_checked_in', 'Idle connections in the pool.', pool.checkedin())
+        + _gauge('db_pool_overflow', 'Connections opened beyond the pool size (negative while not full).', pool.overflow())
+        + _gauge('db_pool_timeouts_total', 'Checkouts that gave up waiting.', _pool_timeouts, 'counter')
+    )
+
+def render_metrics():
+    """Return the whole registry and the pool state in Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for histogram in HISTOGRAMS:
+            lines.extend(histogram.render())
+    lines.extend(_pool_lines())
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    """Instrument every request of the app and serve the registry on /metrics.
+
+    Must run before the engine is created so a configured QueuePool is the instrumented one.
+    """
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+    if options and 'pool_size' in options:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': InstrumentedQueuePool, **options}
+    app.before_request(_start_request)
+    app.after_request(_finish_response)
+    app.teardown_request(_record_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
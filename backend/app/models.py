@@ -1,7 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.types import Boolean, TypeDecorator
 
 db = SQLAlchemy()
 
+class FlagBoolean(TypeDecorator):
+    """Boolean column read and written as the "true"/"false" strings the API has always used"""
+    impl = Boolean
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bool):
+            return value
+        return str(value).lower() == 'true'
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return 'true' if value else 'false'
+
 class User(db.Model):
     __tablename__ = 'users'
     user_id = db.Column(db.Integer, primary_key=True)
@@ -26,14 +43,48 @@ class File(db.Model):
     file_id = db.Column(db.Integer, primary_key=True)
     file_name = db.Column(db.String(50), nullable=False)
     file_type = db.Column(db.String(10), nullable=False)
-    file_path = db.Column(db.String(50), nullable=False)
-    disability = db.Column(db.String(5), nullable=False)
-    visibility = db.Column(db.String(5), nullable=False)
-    favorite = db.Column(db.String(5), nullable=False)
-    file_content = db.Column(db.String(500), nullable=False)
+    file_path = db.Column(db.String(1024), nullable=False)
+    disability = db.Column(FlagBoolean, nullable=False)
+    visibility = db.Column(FlagBoolean, nullable=False)
+    favorite = db.Column(FlagBoolean, nullable=False)
+    # The body lives in the content store (content_blobs), NULL when empty: listings only
+    # carry its hash and size in bytes, /files/<id>/content reads it
+    content_hash = db.Column(db.String(64), db.ForeignKey('content_blobs.content_hash'))
+    content_size = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     mother_file = db.Column(db.String(50), default='')
     mother_file_id = db.Column(db.Integer, db.ForeignKey('files.file_id'), nullable=True)
     row_number = db.Column(db.Integer)
+    # Materialized path of ids from the root down to this file, e.g. '/1/5/9/'.
+    # Kept in sync on insert, move and delete so subtree and ancestor lookups are one indexed query.
+    node_path = db.Column(db.Text)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    # Tree versions that created and last changed the row, for /files/changes. Writes leave
+    # row_version NULL and bump_tree_version stamps every NULL row with the new version.
+    row_version = db.Column(db.BigInteger)
+    created_version = db.Column(db.BigInteger)
+    # Subtree aggregates kept up to date by every write (see utils): the number of
+    # descendants, how many of them are favorite / visible, and the deepest depth in the
+    # subtree, the file itself included. flask files repair-aggregates recomputes them.
+    descendant_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    favorite_descendants = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    visible_descendants = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_depth = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_files_node_path', 'node_path', postgresql_ops={'node_path': 'text_pattern_ops'}),
+        db.Index('ix_files_row_version', 'row_version'),
+        db.Index('ix_files_mother_row', 'mother_file_id', 'row_number'),
+        db.Index('ix_files_content_hash', 'content_hash'),
+        # Partial indexes: only the favorite / visible rows are indexed
+        db.Index(
+            'ix_files_favorite', 'mother_file_id', 'row_number',
+            postgresql_where=favorite, sqlite_where=favorite,
+        ),
+        db.Index(
+            'ix_files_visible', 'mother_file_id', 'row_number',
+            postgresql_where=visibility, sqlite_where=visibility,
+        ),
+    )
 
     # Define a relationship to allow access to child files
     children = db.relationship("File", backref=db.backref('parent', remote_side=[file_id]), lazy='dynamic')
@@ -42,6 +93,21 @@ class File(db.Model):
         return f'<File {self.file_name}>'
     
     def to_dict(self):
+        """Serialize this file with its whole subtree, loaded in one node_path query"""
+        subtree = (
+            File.query
+            .filter(File.node_path.like(f'{self.node_path}%'))
+            .order_by(File.depth, File.row_number)
+        )
+        nodes = {}
+        for file in subtree:
+            node = file._fields_dict()
+            nodes[file.file_id] = node
+            if file.mother_file_id in nodes and file.file_id != self.file_id:
+                nodes[file.mother_file_id]['children'].append(node)
+        return nodes.get(self.file_id) or self._fields_dict()
+
+    def _fields_dict(self):
         return {
             'file_id': self.file_id,
             'file_name': self.file_name,
@@ -53,6 +119,68 @@ class File(db.Model):
             'disability': self.disability,
             'visibility': self.visibility,
             'favorite': self.favorite,
-            'file_content': self.file_content,
-            'children': [child.to_dict() for child in self.children]  # Recursively include children
+            'content_hash': self.content_hash,
+            'content_size': self.content_size,
+            'children': []
         }
+
+# Trigram indexes behind search_files. They only exist on Postgres; other databases scan.
+event.listen(
+    db.Model.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+event.listen(
+    File.__table__, 'after_create',
+    DDL('CREATE INDEX ix_files_file_name_trgm ON files USING gin (file_name gin_trgm_ops)')
+    .execute_if(dialect='postgresql'),
+)
+
+class ContentBlob(db.Model):
+    """A file body stored once per distinct content, keyed by its SHA-256 (see routes/content_store)"""
+    __tablename__ = 'content_blobs'
+    content_hash = db.Column(db.String(64), primary_key=True)
+    # Bytes of the UTF-8 body
+    size = db.Column(db.BigInteger, nullable=False)
+    # Uncompressed beginning of the body, what ?content=1 searches match
+    preview = db.Column(db.Text, nullable=False)
+
+class ContentChunk(db.Model):
+    """zlib-compressed slice of a body, so ranges only decompress the chunks they cover"""
+    __tablename__ = 'content_chunks'
+    content_hash = db.Column(db.String(64), db.ForeignKey('content_blobs.content_hash'), primary_key=True)
+    chunk_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+event.listen(
+    ContentBlob.__table__, 'after_create',
+    DDL('CREATE INDEX ix_content_blobs_preview_trgm ON content_blobs USING gin (preview gin_trgm_ops)')
+    .execute_if(dialect='postgresql'),
+)
+
+class TreeState(db.Model):
+    """Single-row counter bumped by every mutation of the files tree"""
+    __tablename__ = 'tree_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    # Tombstones up to this version were pruned: older clients must reload the whole tree
+    pruned_version = db.Column(db.BigInteger, nullable=False, default=0)
+
+# Seed the single counter row wherever the table is created (migrations seed it in 0002)
+event.listen(
+    TreeState.__table__, 'after_create',
+    DDL('INSERT INTO tree_state (id, version, pruned_version) VALUES (1, 0, 0)'),
+)
+
+class FileTombstone(db.Model):
+    """Id of a deleted file and the tree version that deleted it, for /files/changes"""
+    __tablename__ = 'file_tombstones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.BigInteger, index=True)
+
+@event.listens_for(File, 'before_update')
+def _mark_changed(mapper, connection, target):
+    """Flag a file changed through the ORM so bump_tree_version stamps it"""
+    target.row_version = None
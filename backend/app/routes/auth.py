@@ -0,0 +1,106 @@
+import concurrent.futures
+import logging
+import threading
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from passlib.context import CryptContext
+from werkzeug.security import check_password_hash
+
+# Passwords and session tokens of the /api/auth routes.
+# Hashes are PBKDF2-SHA256 in passlib's format; hashes written by werkzeug before are
+# still accepted and replaced on the next successful login. Hashing is CPU bound, so it
+# runs on a few OS threads per worker (also under gevent) with a bounded queue in front.
+# Session tokens are signed and timestamped: checking one costs an HMAC, no query.
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(
+    schemes=['pbkdf2_sha256'],
+    deprecated='auto',
+    # Same cost as werkzeug's default, so moving a hash over does not weaken it
+    pbkdf2_sha256__default_rounds=260000,
+)
+TOKEN_SALT = 'session-token'
+
+class HashingBusy(Exception):
+    """Every hashing thread is busy and the queue in front of them is full"""
+
+_executor_lock = threading.Lock()
+_executor = None
+_slots = None
+
+def _native_executor():
+    """Executor class running on OS threads, also in gevent workers where threading is patched"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor
+            return ThreadPoolExecutor
+    except ImportError:
+        pass
+    return concurrent.futures.ThreadPoolExecutor
+
+def _hashing_executor():
+    # Created on first use, in the worker process that uses it
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            threads = current_app.config['PASSWORD_HASH_THREADS']
+            _slots = threading.BoundedSemaphore(threads + current_app.config['PASSWORD_HASH_QUEUE'])
+            _executor = _native_executor()(max_workers=threads, thread_name_prefix='password-hash')
+    return _executor, _slots
+
+def _offload(function, *args):
+    """Run function on a hashing thread and wait for it; raises HashingBusy when the queue is full"""
+    executor, slots = _hashing_executor()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+def _verify(password, hashed):
+    if hashed is None:
+        # Unknown user: spend the same time as a real check
+        pwd_context.dummy_verify()
+        return False, None
+    if hashed.startswith('$'):
+        return pwd_context.verify_and_update(password, hashed)
+    # Legacy werkzeug hash ("pbkdf2:sha256:260000$salt$hash")
+    if check_password_hash(hashed, password):
+        return True, pwd_context.hash(password)
+    return False, None
+
+def hash_password(password):
+    """Hash a password with the current scheme"""
+    return _offload(pwd_context.hash, password)
+
+def verify_password(password, hashed):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be replaced.
+
+    hashed may be None for an unknown user, which still costs a full verification.
+    """
+    return _offload(_verify, password, hashed)
+
+def _serializer():
+    # create_app makes sure SECRET_KEY is set
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+def issue_token(user):
+    """Signed session token of a user, valid for SESSION_TOKEN_SECONDS"""
+    return _serializer().dumps({'user_id': user.user_id, 'user_type': user.user_type})
+
+def read_token(token):
+    """Return the session of a token ({'user_id', 'user_type'}), or None if forged or expired"""
+    try:
+        return _serializer().loads(token, max_age=current_app.config['SESSION_TOKEN_SECONDS'])
+    except BadSignature:
+        return None
+
+def current_session():
+    """Session of the request's "Authorization: Bearer <token>" header, or None"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return read_token(token.strip())
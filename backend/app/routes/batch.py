@@ -0,0 +1,223 @@
+from sqlalchemy import case, literal, or_, update
+from werkzeug.exceptions import HTTPException
+from models import db, File
+from .content_store import MAX_CONTENT_BYTES, store_content
+from .events import queue_event
+from .ordering import bulk_update_row_numbers
+from .utils import (
+    CASCADE_FEATURES,
+    FILE_FIELDS,
+    delete_subtree,
+    move_subtree,
+    path_ids,
+    recompute_aggregates,
+    refresh_aggregates,
+    rename_file,
+    subtree_filter,
+)
+
+# POST /files/batch: many edits in one request and one transaction. Operations are
+# validated up front, then applied grouped by type, in this order, with as few
+# statements as possible:
+#   {"op": "update", "file_id": 1, "feature": "file_type", "value": "a"}  one UPDATE per feature (file_content too);
+#                                                                        file_name: one UPDATE per renamed subtree
+#   {"op": "flag", "file_id": 1, "feature": "favorite", "value": "true"}  one UPDATE per run of equal values, cascaded
+#   {"op": "move", "file_id": 1, "mother_file_id": 2}                    one UPDATE per move, in request order
+#   {"op": "reorder", "file_id": 1, "row_number": 2048}                  one UPDATE in total
+#   {"op": "delete", "file_id": 1}                                       one DELETE per subtree
+MAX_BATCH_OPERATIONS = 1000
+BATCH_OPERATIONS = ('update', 'flag', 'move', 'reorder', 'delete')
+# Flags only change through the cascading "flag" operation, which keeps the aggregates right;
+# file_content is stored in the content store and sets content_hash and content_size. file_path
+# follows file_name: a rename rewrites it for the whole subtree, as a move does
+UPDATE_FEATURES = tuple(
+    field for field in FILE_FIELDS
+    if field not in (
+        'file_id', 'mother_file_id', 'row_number', 'file_path', 'content_hash', 'content_size',
+    ) + CASCADE_FEATURES
+) + ('file_content',)
+
+class BatchError(Exception):
+    """A batch operation that can not be applied, with the HTTP status it maps to"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _validate(operation, node_paths):
+    """Raise BatchError if an operation is malformed or refers to a missing file"""
+    if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+        raise BatchError(f"op must be one of: {', '.join(BATCH_OPERATIONS)}")
+    op = operation['op']
+    if operation.get('file_id') not in node_paths:
+        raise BatchError('File not found', 404)
+
+    if op == 'update':
+        if operation.get('feature') not in UPDATE_FEATURES:
+            raise BatchError(f"feature must be one of: {', '.join(UPDATE_FEATURES)}")
+        if operation.get('value') is None:
+            raise BatchError('Missing value')
+        if operation['feature'] == 'file_content' and len(str(operation['value']).encode('utf-8')) > MAX_CONTENT_BYTES:
+            raise BatchError(f'Content is limited to {MAX_CONTENT_BYTES} bytes', 413)
+    elif op == 'flag':
+        if operation.get('feature') not in CASCADE_FEATURES:
+            raise BatchError(f"feature must be one of: {', '.join(CASCADE_FEATURES)}")
+        if operation.get('value') not in ('true', 'false'):
+            raise BatchError('value must be "true" or "false"')
+    elif op == 'move':
+        if 'mother_file_id' not in operation:
+            raise BatchError('Missing mother_file_id')
+        if operation['mother_file_id'] and operation['mother_file_id'] not in node_paths:
+            raise BatchError('Parent file not found', 404)
+    elif op == 'reorder':
+        if not isinstance(operation.get('row_number'), int):
+            raise BatchError('row_number must be an integer')
+
+def _referenced_ids(operations):
+    ids = set()
+    for operation in operations:
+        if isinstance(operation, dict):
+            for key in ('file_id', 'mother_file_id'):
+                if isinstance(operation.get(key), int):
+                    ids.add(operation[key])
+    return ids
+
+def _apply_contents(values):
+    stored = {file_id: store_content(value) for file_id, value in values.items()}
+    db.session.execute(
+        update(File)
+        .where(File.file_id.in_(list(stored)))
+        .values(
+            content_hash=case(
+                {file_id: literal(content_hash, File.content_hash.type) for file_id, (content_hash, _) in stored.items()},
+                value=File.file_id,
+            ),
+            content_size=case({file_id: size for file_id, (_, size) in stored.items()}, value=File.file_id),
+            row_version=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    for file_id, (content_hash, size) in stored.items():
+        queue_event('updated', file_id=file_id, content_hash=content_hash, content_size=size)
+
+def _apply_renames(values):
+    # One subtree UPDATE per renamed file, in request order; nested renames compose
+    for file_id, value in values.items():
+        file = db.session.get(File, file_id)
+        rename_file(file, value)
+        queue_event('updated', file_id=file_id, file_name=value, file_path=file.file_path)
+
+def _apply_updates(updates):
+    for feature in {operation['feature'] for operation in updates}:
+        values = {
+            operation['file_id']: operation['value']
+            for operation in updates if operation['feature'] == feature
+        }
+        if feature == 'file_content':
+            _apply_contents(values)
+            continue
+        if feature == 'file_name':
+            _apply_renames(values)
+            continue
+        # Bound with the column's type so flags are converted like any other write
+        column_type = File.__table__.c[feature].type
+        bound = {file_id: literal(value, column_type) for file_id, value in values.items()}
+        db.session.execute(
+            update(File)
+            .where(File.file_id.in_(list(values)))
+            .values({feature: case(bound, value=File.file_id), 'row_version': None})
+            .execution_options(synchronize_session=False)
+        )
+        for file_id, value in values.items():
+            queue_event('updated', file_id=file_id, **{feature: value})
+
+def _apply_flags(flags, node_paths):
+    # Consecutive operations setting a flag to the same value share a statement; a change
+    # of value starts a new one so nested subtrees still end up as requested
+    runs = []
+    for feature in CASCADE_FEATURES:
+        for operation in flags:
+            if operation['feature'] != feature:
+                continue
+            if not runs or runs[-1][0] != (feature, operation['value']):
+                runs.append(((feature, operation['value']), []))
+            runs[-1][1].append(operation['file_id'])
+
+    for (feature, value), file_ids in runs:
+        db.session.execute(
+            update(File)
+            .where(or_(*(subtree_filter(node_paths[file_id]) for file_id in file_ids)))
+            .values({feature: value, 'row_version': None})
+            .execution_options(synchronize_session=False)
+        )
+        for file_id in file_ids:
+            queue_event('flag', file_id=file_id, feature=feature, value=value)
+
+    if runs:
+        # Flagged subtrees may nest, so their aggregates are recomputed rather than adjusted
+        roots = {operation['file_id'] for operation in flags}
+        recompute_aggregates(or_(*(subtree_filter(node_paths[file_id]) for file_id in roots)))
+        ancestors = {}
+        for file_id in roots:
+            for depth, ancestor in enumerate(path_ids(node_paths[file_id])[:-1]):
+                ancestors[ancestor] = depth
+        refresh_aggregates(sorted(ancestors, key=ancestors.get, reverse=True))
+
+def apply_batch(operations):
+    """Validate and apply a list of operations in the caller's transaction.
+
+    Returns (applied, results) with one {'status': ..} result per operation; when not
+    applied the caller must roll back whatever was already written.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list')
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise BatchError(f'At most {MAX_BATCH_OPERATIONS} operations per batch')
+
+    ids = _referenced_ids(operations)
+    node_paths = dict(
+        db.session.query(File.file_id, File.node_path).filter(File.file_id.in_(ids))
+    ) if ids else {}
+
+    results = []
+    for operation in operations:
+        try:
+            _validate(operation, node_paths)
+            results.append({'status': 200})
+        except BatchError as e:
+            results.append({'status': e.status_code, 'error': str(e)})
+    if any(result['status'] != 200 for result in results):
+        return False, results
+
+    by_op = {op: [] for op in BATCH_OPERATIONS}
+    for index, operation in enumerate(operations):
+        by_op[operation['op']].append((index, operation))
+
+    _apply_updates([operation for _, operation in by_op['update']])
+    _apply_flags([operation for _, operation in by_op['flag']], node_paths)
+
+    for index, operation in by_op['move']:
+        file = db.session.get(File, operation['file_id'])
+        try:
+            moved = move_subtree(file, operation['mother_file_id'] or None)
+        except HTTPException as e:
+            results[index] = {'status': e.code, 'error': e.description}
+            return False, results
+        results[index]['moved'] = moved
+        queue_event(
+            'moved', file_id=file.file_id, mother_file_id=file.mother_file_id,
+            row_number=file.row_number, count=moved,
+        )
+
+    pairs = [(operation['file_id'], operation['row_number']) for _, operation in by_op['reorder']]
+    if pairs:
+        db.session.flush()  # Moves assign row_numbers through the ORM; these come last
+        bulk_update_row_numbers(pairs)
+        queue_event('reordered', files=[list(pair) for pair in pairs])
+
+    for index, operation in by_op['delete']:
+        deleted = delete_subtree(operation['file_id'])
+        results[index]['deleted'] = deleted
+        if deleted:
+            queue_event('deleted', file_id=operation['file_id'], count=deleted)
+    return True, results
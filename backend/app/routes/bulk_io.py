@@ -0,0 +1,333 @@
+import json
+from flask import current_app
+from sqlalchemy import (
+    BigInteger, Column, Integer, MetaData, Table, Text, bindparam, case, cast, func, literal, select, text,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import aliased, load_only
+from models import db, File
+from .content_store import ContentTooLarge, load_contents, store_content
+from .ordering import ROW_GAP, next_row_number
+from .utils import CASCADE_FEATURES, path_ids, recompute_aggregates, refresh_aggregates
+
+# Whole trees (or subtrees) as NDJSON, one file per line:
+#   {"id": 5, "parent": 1, "file_name": "a", "file_type": "content", "disability": "false",
+#    "visibility": "true", "favorite": "false", "file_content": "", "mother_file": ""}
+# `id` and `parent` are references inside the document only; imported files get new ids.
+# Imports go through a temporary staging table, loaded with COPY on Postgres and with
+# batched INSERTs elsewhere, so parents are resolved in SQL and memory stays at one batch
+# whatever the size of the tree. psycopg2 refuses COPY once a wait callback is installed
+# (psycogreen, under the gevent workers of gunicorn.conf.py): those load with INSERTs too.
+
+IMPORT_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FIELDS = (
+    'file_name', 'file_type', 'disability', 'visibility', 'favorite', 'file_content', 'mother_file',
+)
+# Columns of files itself; file_content goes through the content store
+FILE_COLUMNS = tuple(field for field in EXPORT_FIELDS if field != 'file_content')
+IMPORT_DEFAULTS = {
+    'file_type': 'content',
+    'disability': 'false',
+    'visibility': 'true',
+    'favorite': 'false',
+    'file_content': '',
+    'mother_file': '',
+}
+
+class TreeImportError(Exception):
+    """An NDJSON document that can not be imported"""
+
+def export_lines(root_id=None):
+    """Yield the NDJSON lines of every file, or of the subtree of root_id, parents first"""
+    columns = FILE_COLUMNS + ('file_id', 'mother_file_id', 'row_number', 'depth', 'content_hash')
+    query = File.query.options(load_only(*(getattr(File, field) for field in columns)))
+    if root_id is not None:
+        root = db.session.query(File.node_path, File.depth).filter(File.file_id == root_id).first()
+        if root is None:
+            return None
+        query = query.filter(File.node_path.like(f'{root.node_path}%'))
+
+    def encode(files):
+        # Contents of a whole batch come in one query
+        contents = load_contents(file.content_hash for file in files)
+        for file in files:
+            line = {
+                'id': file.file_id,
+                'parent': None if file.file_id == root_id else file.mother_file_id,
+            }
+            line.update(
+                (field, contents.get(file.content_hash, '') if field == 'file_content' else getattr(file, field))
+                for field in EXPORT_FIELDS
+            )
+            yield json.dumps(line, separators=(',', ':')) + '\n'
+
+    def lines():
+        rows = query.order_by(File.depth, File.mother_file_id, File.row_number)
+        batch = []
+        for file in rows.yield_per(EXPORT_BATCH_SIZE):
+            batch.append(file)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                yield from encode(batch)
+                batch = []
+        yield from encode(batch)
+    return lines()
+
+def _staging_table():
+    return Table(
+        'file_import', MetaData(),
+        Column('seq', BigInteger, primary_key=True),
+        Column('temp_id', Text, nullable=False, index=True),
+        Column('parent_temp', Text),
+        Column('file_id', Integer, index=True),
+        *(Column(field, Text) for field in EXPORT_FIELDS),
+        prefixes=['TEMPORARY'],
+        postgresql_on_commit='DROP',
+    )
+
+def _parse_lines(stream):
+    """Yield one staging row per NDJSON line of a byte stream"""
+    seq = 0
+    for number, raw in enumerate(stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+        except ValueError:
+            raise TreeImportError(f'Line {number}: invalid JSON')
+        if not isinstance(line, dict) or line.get('id') is None or not line.get('file_name'):
+            raise TreeImportError(f'Line {number}: id and file_name are required')
+        seq += 1
+        row = {
+            'seq': seq,
+            'temp_id': str(line['id']),
+            'parent_temp': None if line.get('parent') is None else str(line['parent']),
+            'file_id': None,
+        }
+        for field in EXPORT_FIELDS:
+            value = line.get(field)
+            if value is None:
+                row[field] = IMPORT_DEFAULTS.get(field)
+            elif field in CASCADE_FEATURES:
+                row[field] = _flag_value(value, field, number)
+            else:
+                row[field] = str(value)
+        yield row
+
+def _flag_value(value, field, number):
+    """Stage a flag as "true"/"false" text; JSON booleans and any letter case are accepted"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower()
+    raise TreeImportError(f'Line {number}: {field} must be true or false')
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+class _CopySource:
+    """File-like object feeding staging rows to COPY ... FROM STDIN in text format"""
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += '\t'.join(_copy_value(row[column]) for column in self.columns) + '\n'
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def _can_copy(connection):
+    """Whether COPY FROM STDIN is available: Postgres with psycopg2 not made cooperative"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    from psycopg2.extensions import get_wait_callback
+    return get_wait_callback() is None
+
+def _load_staging(connection, staging, rows):
+    """Fill the staging table: COPY when available, batched INSERTs otherwise"""
+    if _can_copy(connection):
+        columns = [column.name for column in staging.columns]
+        statement = f"COPY {staging.name} ({', '.join(columns)}) FROM STDIN"
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, _CopySource(rows, columns))
+        except connection.dialect.dbapi.Error as e:
+            # The raw cursor bypasses SQLAlchemy; wrap the error as it would have
+            raise DBAPIError.instance(statement, None, e, connection.dialect.dbapi.Error, dialect=connection.dialect)
+        return
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            connection.execute(staging.insert(), batch)
+            batch = []
+    if batch:
+        connection.execute(staging.insert(), batch)
+
+def import_tree(stream, parent=None):
+    """Import an NDJSON document from a byte stream, under `parent` or as new roots.
+
+    Runs in the caller's transaction (which bumps the tree version) and returns the
+    number of files created. Raises TreeImportError for malformed documents, unknown
+    parent references and cycles.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        # A large document outlasts the per-request statement_timeout; this lasts until commit
+        timeout = int(current_app.config['DB_BULK_STATEMENT_TIMEOUT_MS'])
+        connection.execute(text(f'SET LOCAL statement_timeout = {timeout}'))
+    staging = _staging_table()
+    staging.create(bind=connection)
+    _load_staging(connection, staging, _parse_lines(stream))
+    count, distinct = connection.execute(
+        select(func.count(), func.count(staging.c.temp_id.distinct())).select_from(staging)
+    ).one()
+    if not count:
+        staging.drop(bind=connection)
+        return 0
+    if distinct != count:
+        raise TreeImportError(f'{count - distinct} ids appear more than once')
+
+    parent_row = staging.alias('parent_import')
+    missing = connection.execute(
+        select(func.count())
+        .select_from(staging.outerjoin(parent_row, parent_row.c.temp_id == staging.c.parent_temp))
+        .where(staging.c.parent_temp.isnot(None), parent_row.c.seq.is_(None))
+    ).scalar()
+    if missing:
+        raise TreeImportError(f'{missing} files refer to a parent that is not in the document')
+
+    # New ids: the serial sequence on Postgres; elsewhere the transaction holds the write lock
+    if connection.dialect.name == 'postgresql':
+        new_id = func.nextval(func.pg_get_serial_sequence('files', 'file_id'))
+    else:
+        new_id = (db.session.query(func.max(File.file_id)).scalar() or 0) + staging.c.seq
+    connection.execute(update(staging).values(file_id=new_id))
+
+    # Siblings keep their document order, ROW_GAP apart, after the parent's existing children
+    top_offset = next_row_number(parent.file_id if parent else None) - ROW_GAP
+    position = func.row_number().over(partition_by=staging.c.parent_temp, order_by=staging.c.seq)
+    rows = (
+        select(
+            staging.c.file_id,
+            parent_row.c.file_id.label('mother_file_id'),
+            position.label('position'),
+            staging.c.parent_temp,
+            *(staging.c[field] for field in EXPORT_FIELDS),
+        )
+        .select_from(staging.outerjoin(parent_row, parent_row.c.temp_id == staging.c.parent_temp))
+        .subquery()
+    )
+    is_top = rows.c.parent_temp.is_(None)
+    connection.execute(
+        File.__table__.insert().from_select(
+            ['file_id', 'mother_file_id', 'row_number', 'file_path', 'depth', *FILE_COLUMNS],
+            select(
+                rows.c.file_id,
+                case((is_top, literal(parent.file_id if parent else None, Integer)), else_=rows.c.mother_file_id),
+                rows.c.position * ROW_GAP + case((is_top, top_offset), else_=0),
+                literal(''),
+                literal(0),
+                # Flags are staged as "true"/"false" text
+                *(
+                    rows.c[field] == 'true' if field in CASCADE_FEATURES else rows.c[field]
+                    for field in FILE_COLUMNS
+                ),
+            ),
+        )
+    )
+    _index_imported(staging, parent)
+    _store_imported_contents(connection, staging)
+    recompute_aggregates(File.file_id.in_(select(staging.c.file_id)))
+    if parent is not None:
+        refresh_aggregates(reversed(path_ids(parent.node_path)))
+    staging.drop(bind=connection)
+    return count
+
+def _store_imported_contents(connection, staging):
+    """Move the staged bodies into the content store, one batch of files at a time"""
+    files = File.__table__
+    point = (
+        files.update()
+        .where(files.c.file_id == bindparam('b_file_id'))
+        .values(content_hash=bindparam('b_content_hash'), content_size=bindparam('b_content_size'))
+    )
+    last_seq = 0
+    while True:
+        rows = connection.execute(
+            select(staging.c.seq, staging.c.temp_id, staging.c.file_id, staging.c.file_content)
+            .where(staging.c.seq > last_seq, staging.c.file_content != '')
+            .order_by(staging.c.seq)
+            .limit(IMPORT_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        last_seq = rows[-1].seq
+        stored = []
+        for row in rows:
+            try:
+                content_hash, size = store_content(row.file_content)
+            except ContentTooLarge as e:
+                raise TreeImportError(f'File {row.temp_id}: {e}')
+            stored.append({'b_file_id': row.file_id, 'b_content_hash': content_hash, 'b_content_size': size})
+        connection.execute(point, stored)
+
+def _index_imported(staging, parent):
+    """Fill node_path, depth and file_path of the imported files, one UPDATE per level"""
+    imported = File.file_id.in_(select(staging.c.file_id))
+    if parent is None:
+        top = File.mother_file_id.is_(None)
+        values = {
+            'node_path': literal('/') + cast(File.file_id, db.Text) + '/',
+            'depth': 0,
+            'file_path': literal('/') + File.file_name,
+        }
+    else:
+        top = File.mother_file_id == parent.file_id
+        values = {
+            'node_path': literal(parent.node_path) + cast(File.file_id, db.Text) + '/',
+            'depth': parent.depth + 1,
+            'file_path': literal(f'{parent.file_path}/') + File.file_name,
+        }
+    db.session.execute(
+        update(File).where(imported, top).values(values).execution_options(synchronize_session=False)
+    )
+
+    # Then every file whose parent already has its path, until a pass changes nothing
+    mother = aliased(File)
+
+    def from_parent(column):
+        return select(column).where(mother.file_id == File.mother_file_id).scalar_subquery()
+
+    while True:
+        parent_path = from_parent(mother.node_path)
+        result = db.session.execute(
+            update(File)
+            .where(imported, File.node_path.is_(None), parent_path.isnot(None))
+            .values(
+                node_path=parent_path + cast(File.file_id, db.Text) + '/',
+                depth=from_parent(mother.depth) + 1,
+                file_path=from_parent(mother.file_path) + '/' + File.file_name,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            break
+
+    orphaned = db.session.query(func.count(File.file_id)).filter(imported, File.node_path.is_(None)).scalar()
+    if orphaned:
+        raise TreeImportError(f'{orphaned} files are part of a parent cycle')
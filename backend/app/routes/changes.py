@@ -0,0 +1,72 @@
+from sqlalchemy import delete, update
+from models import db, File, FileTombstone, TreeState
+from .utils import TREE_STATE_ID, file_to_dict, load_fields
+
+# Delta sync: every write stamps the files it touched (row_version) and the ids it deleted
+# (file_tombstones) with the tree version it committed, so a client that holds the tree at
+# version N only needs the rows stamped after N.
+
+# Above this many changed rows a client is better off reloading the whole tree
+MAX_CHANGES = 10000
+
+def changes_since(since, fields=None):
+    """Return the files inserted, updated and deleted after tree version `since`.
+
+    Returns None when that history is no longer available (tombstones pruned, unknown
+    version or too many changes): the client has to reload the tree. A deleted id may
+    come back as inserted when the database reused it, so deletions apply first.
+    """
+    # The version is read before the rows, which can then only be newer than it
+    state = (
+        db.session.query(TreeState.version, TreeState.pruned_version)
+        .filter(TreeState.id == TREE_STATE_ID)
+        .first()
+    )
+    version, pruned_version = state or (0, 0)
+    if since < pruned_version or since > version:
+        return None
+
+    files = (
+        load_fields(File.query, fields, 'created_version')
+        .filter(File.row_version > since)
+        .order_by(File.row_version, File.file_id)
+        .limit(MAX_CHANGES + 1)
+        .all()
+    )
+    deleted = [
+        file_id for (file_id,) in
+        db.session.query(FileTombstone.file_id)
+        .filter(FileTombstone.version > since)
+        .distinct()
+        .limit(MAX_CHANGES + 1)
+    ]
+    if len(files) + len(deleted) > MAX_CHANGES:
+        return None
+
+    inserted, updated = [], []
+    for file in files:
+        data = file_to_dict(file, fields)
+        del data['children']
+        (inserted if file.created_version > since else updated).append(data)
+    return {
+        'since': since,
+        'version': version,
+        'inserted': inserted,
+        'updated': updated,
+        'deleted': sorted(deleted),
+    }
+
+def prune_tombstones(before_version):
+    """Drop the tombstones of versions up to `before_version`, returning how many were removed"""
+    result = db.session.execute(
+        delete(FileTombstone)
+        .where(FileTombstone.version <= before_version)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(TreeState)
+        .where(TreeState.id == TREE_STATE_ID, TreeState.pruned_version < before_version)
+        .values(pruned_version=before_version)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
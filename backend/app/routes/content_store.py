@@ -0,0 +1,112 @@
+import hashlib
+import zlib
+from sqlalchemy import delete, exists, select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, ContentBlob, ContentChunk, File
+
+# File bodies, out of the files rows. A body is stored once per distinct content under
+# its SHA-256, split into CHUNK_SIZE byte chunks compressed one by one: a range only reads
+# and decompresses the chunks it covers, and a large body streams chunk by chunk. Bodies
+# are never updated in place; a file pointing at another hash leaves the old body behind
+# until `flask files gc-contents` drops the ones no file refers to.
+
+CHUNK_SIZE = 64 * 1024
+# Chunks fetched per query while streaming a body
+CHUNK_BATCH_SIZE = 16
+MAX_CONTENT_BYTES = 64 * 1024 * 1024
+# Characters kept uncompressed for content search, the old inline limit
+PREVIEW_CHARS = 500
+COMPRESSION_LEVEL = 6
+
+class ContentTooLarge(Exception):
+    """A body above MAX_CONTENT_BYTES"""
+
+def _insert_missing(model, rows):
+    """INSERT rows, skipping the keys that already exist (a concurrent writer stored the same body)"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(model.__table__).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(model.__table__).on_conflict_do_nothing()
+    else:
+        statement = model.__table__.insert()
+    db.session.execute(statement, rows)
+
+def store_content(body):
+    """Store a body (text or UTF-8 bytes) unless already present; returns (content_hash, size).
+
+    The empty body is not stored and gives (None, 0).
+    """
+    data = bytes(body) if isinstance(body, (bytes, bytearray)) else str(body).encode('utf-8')
+    if not data:
+        return None, 0
+    if len(data) > MAX_CONTENT_BYTES:
+        raise ContentTooLarge(f'Content is limited to {MAX_CONTENT_BYTES} bytes')
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    stored = db.session.query(exists().where(ContentBlob.content_hash == content_hash)).scalar()
+    if not stored:
+        preview = data[:PREVIEW_CHARS * 4].decode('utf-8', errors='ignore')[:PREVIEW_CHARS]
+        _insert_missing(ContentBlob, [{'content_hash': content_hash, 'size': len(data), 'preview': preview}])
+        _insert_missing(ContentChunk, [
+            {
+                'content_hash': content_hash,
+                'chunk_index': index,
+                'data': zlib.compress(data[offset:offset + CHUNK_SIZE], COMPRESSION_LEVEL),
+            }
+            for index, offset in enumerate(range(0, len(data), CHUNK_SIZE))
+        ])
+    return content_hash, len(data)
+
+def content_bytes(content_hash, start=0, stop=None):
+    """Yield the bytes of a stored body from start up to stop (exclusive), chunk by chunk"""
+    if content_hash is None:
+        return
+    query = (
+        db.session.query(ContentChunk.chunk_index, ContentChunk.data)
+        .filter(ContentChunk.content_hash == content_hash, ContentChunk.chunk_index >= start // CHUNK_SIZE)
+        .order_by(ContentChunk.chunk_index)
+    )
+    if stop is not None:
+        query = query.filter(ContentChunk.chunk_index <= (stop - 1) // CHUNK_SIZE)
+    for index, data in query.yield_per(CHUNK_BATCH_SIZE):
+        chunk = zlib.decompress(data)
+        offset = index * CHUNK_SIZE
+        end = len(chunk) if stop is None else min(stop - offset, len(chunk))
+        yield chunk[max(start - offset, 0):end]
+
+def read_content(content_hash):
+    """Return a whole stored body as text, '' for no body"""
+    return b''.join(content_bytes(content_hash)).decode('utf-8')
+
+def load_contents(content_hashes):
+    """Return {content_hash: text} of many bodies in one query"""
+    content_hashes = {content_hash for content_hash in content_hashes if content_hash}
+    if not content_hashes:
+        return {}
+    chunks = {}
+    rows = (
+        db.session.query(ContentChunk.content_hash, ContentChunk.data)
+        .filter(ContentChunk.content_hash.in_(content_hashes))
+        .order_by(ContentChunk.content_hash, ContentChunk.chunk_index)
+    )
+    for content_hash, data in rows:
+        chunks.setdefault(content_hash, []).append(zlib.decompress(data))
+    return {content_hash: b''.join(parts).decode('utf-8') for content_hash, parts in chunks.items()}
+
+def collect_garbage():
+    """Delete the bodies no file refers to any more, returning how many were removed"""
+    unused = select(ContentBlob.content_hash).where(
+        ~exists().where(File.content_hash == ContentBlob.content_hash)
+    )
+    db.session.execute(
+        delete(ContentChunk)
+        .where(ContentChunk.content_hash.in_(unused))
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        delete(ContentBlob)
+        .where(ContentBlob.content_hash.in_(unused))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,182 @@
+from collections import deque
+import json
+import logging
+import select
+import threading
+import time
+from sqlalchemy import event, func, text
+from models import db, TreeState
+
+# Push of tree mutations to /files/stream subscribers (Server-Sent Events).
+# Routes queue compact events on the session; when the transaction commits they are
+# published as one message tagged with the tree version it committed. Each worker keeps
+# the recent messages in an EventBroker that its subscribers wait on. On Postgres the
+# message goes through NOTIFY, which is only delivered on commit, and a LISTEN thread per
+# worker feeds the broker, so every worker sees every commit. Elsewhere messages are
+# published in-process, which only reaches subscribers of the same process.
+
+CHANNEL = 'tree_events'
+# NOTIFY payloads are limited to 8000 bytes; bigger messages only carry the version
+MAX_NOTIFY_PAYLOAD = 7900
+EVENT_BUFFER_SIZE = 1000
+KEEPALIVE_SECONDS = 15
+LISTEN_RETRY_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+class EventBroker:
+    """Recent messages of one worker, with blocking reads for the subscribers"""
+
+    def __init__(self, size=EVENT_BUFFER_SIZE):
+        self._messages = deque(maxlen=size)
+        self._condition = threading.Condition()
+        self._sequence = 0
+
+    def publish(self, message):
+        with self._condition:
+            self._sequence += 1
+            self._messages.append((self._sequence, message))
+            self._condition.notify_all()
+
+    def position(self):
+        """Sequence number of the latest message, to read what comes after it"""
+        with self._condition:
+            return self._sequence
+
+    def replay(self, version):
+        """Return (position, messages committed after `version`), or None when the buffer does not go back that far"""
+        with self._condition:
+            if not self._messages or self._messages[0][1]['version'] > version + 1:
+                return None
+            messages = [message for _, message in self._messages if message['version'] > version]
+            return self._sequence, messages
+
+    def wait(self, position, timeout):
+        """Return (position, messages after position), waiting up to `timeout` seconds for one.
+
+        Messages may have been dropped from the buffer meanwhile; then None is returned instead.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > position, timeout)
+            missed = self._sequence - position
+            if missed > len(self._messages):
+                return None
+            messages = [message for _, message in list(self._messages)[len(self._messages) - missed:]]
+            return self._sequence, messages
+
+broker = EventBroker()
+
+_listener_lock = threading.Lock()
+_listener = None
+
+# Columns of a file sent in 'added' events
+EVENT_FIELDS = ('file_id', 'mother_file_id', 'row_number', 'file_name', 'file_type')
+
+def _tree_version(session):
+    return session.query(func.max(TreeState.version)).scalar() or 0
+
+def event_file(file):
+    """Compact dict of a file for events"""
+    return {field: getattr(file, field) for field in EVENT_FIELDS}
+
+def queue_event(event_type, **data):
+    """Queue an event on the current transaction, published only if it commits"""
+    db.session.info.setdefault('tree_events', []).append({'type': event_type, **data})
+
+@event.listens_for(db.session, 'before_commit')
+def _prepare_events(session):
+    events = session.info.pop('tree_events', None)
+    if not events:
+        return
+    message = {'version': _tree_version(session), 'events': events}
+    if session.get_bind().dialect.name == 'postgresql':
+        payload = json.dumps(message, separators=(',', ':'))
+        if len(payload) > MAX_NOTIFY_PAYLOAD:
+            payload = json.dumps({'version': message['version'], 'truncated': True})
+        session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': CHANNEL, 'payload': payload})
+    else:
+        session.info['tree_message'] = message
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_events(session):
+    message = session.info.pop('tree_message', None)
+    if message is not None:
+        broker.publish(message)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_events(session):
+    session.info.pop('tree_events', None)
+    session.info.pop('tree_message', None)
+
+def _listen(engine):
+    """Forward NOTIFY messages into the broker for the life of the worker, reconnecting on errors"""
+    while True:
+        try:
+            connection = engine.raw_connection().detach()
+            connection.connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute(f'LISTEN {CHANNEL}')
+            raw = connection.connection
+            while True:
+                if select.select([raw], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    broker.publish(json.loads(raw.notifies.pop(0).payload))
+        except Exception as e:
+            logger.error(f"Event listener failed, retrying: {str(e)}")
+            time.sleep(LISTEN_RETRY_SECONDS)
+
+def start_listener():
+    """Start this worker's LISTEN thread on Postgres, once"""
+    global _listener
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, args=(db.engine,), name='tree-events', daemon=True)
+            _listener.start()
+
+def _format(message, event_type=None):
+    """Encode a message as SSE; only tree messages carry an id, which clients resume from"""
+    data = json.dumps(message, separators=(',', ':'))
+    if event_type is None:
+        return f"id: {message['version']}\nevent: tree\ndata: {data}\n\n"
+    return f"event: {event_type}\ndata: {data}\n\n"
+
+def subscribe(last_version=None):
+    """Return the SSE stream of a subscriber that has seen the tree up to `last_version`.
+
+    Called inside the request; the stream itself runs without a database connection.
+    Missed messages are replayed from the buffer when it still holds them; otherwise a
+    'resync' event asks the client to catch up with /files/changes or reload the tree.
+    """
+    start_listener()
+    position = broker.position()
+    current = _tree_version(db.session)
+    return _stream(position, current, last_version)
+
+def _stream(position, current, last_version):
+    yield f'retry: {LISTEN_RETRY_SECONDS * 1000}\n\n'
+    yield _format({'version': current}, 'ready')
+    if last_version is not None and last_version < current:
+        replayed = broker.replay(last_version)
+        if replayed is None:
+            yield _format({'version': current}, 'resync')
+        else:
+            position, messages = replayed
+            for message in messages:
+                yield _format(message)
+
+    while True:
+        result = broker.wait(position, KEEPALIVE_SECONDS)
+        if result is None:
+            position = broker.position()
+            yield _format({'version': current}, 'resync')
+            continue
+        position, messages = result
+        if not messages:
+            yield ': keep-alive\n\n'
+        for message in messages:
+            current = message['version']
+            yield _format(message)
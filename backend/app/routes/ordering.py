@@ -0,0 +1,99 @@
+from sqlalchemy import Integer, case, column, func, update, values
+from models import db, File
+
+# Distance between consecutive sibling row_numbers; a move writes the midpoint of its neighbours
+ROW_GAP = 1024
+
+def siblings_of(mother_file_id):
+    """Query the files sharing a parent (the roots for None)"""
+    if mother_file_id is None:
+        return File.query.filter(File.mother_file_id.is_(None))
+    return File.query.filter(File.mother_file_id == mother_file_id)
+
+def next_row_number(mother_file_id):
+    """Return a row_number placing a new file after all of its siblings"""
+    last = siblings_of(mother_file_id).with_entities(func.max(File.row_number)).scalar()
+    return (last or 0) + ROW_GAP
+
+def bulk_update_row_numbers(pairs):
+    """Set many row_numbers in one UPDATE; pairs are (file_id, row_number). Returns the rowcount.
+
+    Postgres joins against a VALUES list, other databases use a CASE over the ids.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return 0
+
+    if db.engine.dialect.name == 'postgresql':
+        new_order = values(
+            column('file_id', Integer), column('row_number', Integer), name='new_order'
+        ).data(pairs)
+        statement = (
+            update(File)
+            .where(File.file_id == new_order.c.file_id)
+            .values(row_number=new_order.c.row_number, row_version=None)
+        )
+    else:
+        statement = (
+            update(File)
+            .where(File.file_id.in_([file_id for file_id, _ in pairs]))
+            .values(row_number=case(dict(pairs), value=File.file_id), row_version=None)
+        )
+    result = db.session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount
+
+def rebalance_siblings(mother_file_id):
+    """Spread the siblings of a parent ROW_GAP apart, keeping their order, in one UPDATE"""
+    ordered = (
+        siblings_of(mother_file_id)
+        .with_entities(File.file_id)
+        .order_by(File.row_number, File.file_id)
+    )
+    return bulk_update_row_numbers(
+        (file_id, (index + 1) * ROW_GAP) for index, (file_id,) in enumerate(ordered)
+    )
+
+def _neighbour_row_number(file, target, after):
+    """Return the row_number next to target on the requested side, ignoring file itself"""
+    others = siblings_of(target.mother_file_id).filter(File.file_id != file.file_id)
+    if after:
+        return others.filter(File.row_number > target.row_number).with_entities(
+            func.min(File.row_number)
+        ).scalar()
+    return others.filter(File.row_number < target.row_number).with_entities(
+        func.max(File.row_number)
+    ).scalar()
+
+def _has_tie(file, target):
+    """True when another sibling shares the target's row_number"""
+    return db.session.query(
+        siblings_of(target.mother_file_id)
+        .filter(
+            File.row_number == target.row_number,
+            File.file_id.notin_([file.file_id, target.file_id]),
+        )
+        .exists()
+    ).scalar()
+
+def move_next_to(file, target, after):
+    """Place file right before (or after) its sibling target by rewriting only file's row_number.
+
+    Siblings are rebalanced in one statement first when there is no room between target
+    and its neighbour, or when legacy rows share the target's row_number; returns True then.
+    """
+    neighbour = _neighbour_row_number(file, target, after)
+    rebalanced = target.row_number is None or _has_tie(file, target) or (
+        neighbour is not None and abs(neighbour - target.row_number) < 2
+    )
+    if rebalanced:
+        rebalance_siblings(target.mother_file_id)
+        db.session.refresh(file)
+        db.session.refresh(target)
+        neighbour = _neighbour_row_number(file, target, after)
+
+    if neighbour is None:
+        step = ROW_GAP if after else -ROW_GAP
+        file.row_number = target.row_number + step
+    else:
+        file.row_number = (target.row_number + neighbour) // 2
+    return rebalanced
@@ -1,79 +1,296 @@
-from flask import Blueprint, request, jsonify, abort
+import click
+from flask import Blueprint, current_app, request, jsonify, abort, stream_with_context
 from sqlalchemy.exc import SQLAlchemyError
 from models import db, File
+from startup import is_database_ready
 import logging
 from .utils import (
     handle_error,
-    file_to_dict,
-    build_hierarchical_structure,
     create_mother_file,
-    update_children_visibility,
-    update_children_favorite,
-    update_children_disability,
+    assign_node_path,
+    bump_tree_version,
+    cascade_file_feature,
+    count_new_file,
+    delete_subtree,
+    get_children_slice,
+    move_subtree,
+    parse_fields,
+    rebuild_tree_index,
+    recompute_aggregates,
+    set_file_content,
     update_file_feature,
-    check_postgres_connection,
+    check_database_connection,
 )
+from .ordering import (
+    ROW_GAP,
+    bulk_update_row_numbers,
+    move_next_to,
+    next_row_number,
+    rebalance_siblings,
+    siblings_of,
+)
+from .batch import BatchError, apply_batch
+from .bulk_io import TreeImportError, export_lines, import_tree
+from .changes import changes_since, prune_tombstones
+from .content_store import (
+    MAX_CONTENT_BYTES,
+    ContentTooLarge,
+    collect_garbage,
+    content_bytes,
+    read_content,
+)
+from .events import event_file, queue_event, subscribe
+from .search import (
+    DEFAULT_SEARCH_LIMIT,
+    MAX_SEARCH_LIMIT,
+    SEARCH_MODES,
+    decode_cursor,
+    search_files_page,
+)
+from .tree_cache import tree_response
+from .tree_filter import flag_filter, parse_filter
+from .tree_stream import compact_json, stream_nodes, streamed_response, wants_stream
+from .wire_format import JSON_FORMAT, MIMETYPES, encode_tree, requested_format
 bp_files = Blueprint('files', __name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def requested_fields():
+    """Parse the ?fields= projection of a listing, answering 400 for unknown names"""
+    try:
+        return parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        handle_error(str(e), 400)
+
+
 @bp_files.route('/search_files', methods=['GET'])
 def search_files():
+    """Search file names, best matches first.
+
+    ?mode=prefix for typeahead, ?content=1 to also match the beginning of contents, ?limit= and
+    ?cursor= for keyset paging; the next page's cursor is sent in X-Next-Cursor.
+    ?fields= restricts the returned columns.
+    """
+    fields = requested_fields()
     try:
         # Request query parameters
         search_term = request.args.get('query', '')
-        # Search the database for files with a name matching the search term
-        if search_term:
-            files = File.query.filter(File.file_name.ilike(f'%{search_term}%')).order_by(File.row_number).all()
-        else:
+        if not search_term:
             return jsonify([])  # Return an empty list if no search term is provided
-        # Convert the file objects to dictionaries for JSON response
-        file_dicts = [file_to_dict(file) for file in files]
-        return jsonify(file_dicts), 200
+        mode = request.args.get('mode', 'contains')
+        limit = request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)
+        cursor = request.args.get('cursor')
+        if mode not in SEARCH_MODES:
+            return handle_error(f"mode must be one of {', '.join(SEARCH_MODES)}", 400)
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            return handle_error(f'limit must be between 1 and {MAX_SEARCH_LIMIT}', 400)
+        try:
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return handle_error(str(e), 400)
+
+        hits, next_cursor = search_files_page(
+            search_term,
+            mode=mode,
+            limit=limit,
+            cursor=cursor,
+            include_content=request.args.get('content', '').lower() in ('1', 'true'),
+            fields=fields,
+        )
+        # ?stream=1 sends the same page, encoded as it goes
+        if wants_stream():
+            response = streamed_response(stream_nodes(hits))
+        else:
+            response = current_app.response_class(compact_json(hits), mimetype='application/json')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
 
     except SQLAlchemyError as e:
         logging.error(f"Error searching files: {str(e)}")
-        return handle_error(e)
+        return handle_error(f"Database error occurred: {str(e)}", 500)
 
 
 @bp_files.route('/files', methods=['GET'])
 def get_files():
     """Get all files in a hierarchical structure"""
+    fields = requested_fields()
     try:
-        files = File.query.order_by(File.row_number).all()
-        print(files)
-        file_dict = {file.file_id: file_to_dict(file) for file in files}
-        tree = build_hierarchical_structure(file_dict)
-        return jsonify({'files': tree}), 200
+        return tree_response('files', File.query, fields)
     except Exception as e:
         handle_error(f"Error occurred: {str(e)}", 500)
         
 @bp_files.route('/files/favorites', methods=['GET'])
 def get_favorite_files():
-    """Get all files marked as favorite in a hierarchical structure"""
+    """Get all files marked as favorite in a hierarchical structure, under their ancestors"""
+    fields = requested_fields()
     try:
-        # Fetch only the files where favorite is "true"
-        favorite_files = File.query.filter_by(favorite="true").order_by(File.row_number).all()
-        file_dict = {file.file_id: file_to_dict(file) for file in favorite_files}
-        tree = build_hierarchical_structure(file_dict)
-        return jsonify({'files': tree}), 200
+        return tree_response('favorites', File.query, fields, flag_filter('favorite'))
     except Exception as e:
         handle_error(f"Error occurred: {str(e)}", 500)
 
 
 @bp_files.route('/files/visible', methods=['GET'])
 def get_visible_files():
-    """Get all files marked as visible in a hierarchical structure"""
+    """Get all files marked as visible in a hierarchical structure, under their ancestors"""
+    fields = requested_fields()
+    try:
+        return tree_response('visible', File.query, fields, flag_filter('visibility'))
+    except Exception as e:
+        handle_error(f"Error occurred: {str(e)}", 500)
+
+
+@bp_files.route('/files/filter', methods=['GET'])
+def get_filtered_files():
+    """Get the files matching a filter with their ancestors, e.g.
+    ?favorite=true&visibility=true&disability=false&name=report
+
+    Flags and ?name= (substring) / ?name_prefix= are combined with AND; every node has a
+    'matched' flag telling matches from the ancestors kept for context.
+    """
+    fields = requested_fields()
+    try:
+        where = parse_filter(request.args)
+    except ValueError as e:
+        handle_error(str(e), 400)
+    try:
+        return tree_response('filter', File.query, fields, where)
+    except Exception as e:
+        handle_error(f"Error occurred: {str(e)}", 500)
+
+
+@bp_files.route('/files/changes', methods=['GET'])
+def get_file_changes():
+    """Files inserted, updated and deleted since ?since=<version>, for delta sync.
+
+    Clients keep the returned version and pass it back next time; 410 means the history
+    is gone and the whole tree has to be reloaded from /files.
+    """
+    fields = requested_fields()
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        handle_error('since must be a tree version', 400)
     try:
-        # Fetch only the files where visible is "true"
-        visible_files = File.query.filter_by(visibility="true").order_by(File.row_number).all()
-        file_dict = {file.file_id: file_to_dict(file) for file in visible_files}
-        tree = build_hierarchical_structure(file_dict)
-        return jsonify({'files': tree}), 200
+        changes = changes_since(since, fields)
     except Exception as e:
         handle_error(f"Error occurred: {str(e)}", 500)
+    if changes is None:
+        return jsonify({'error': 'Changes are no longer available, reload the tree'}), 410
+    return jsonify(changes), 200
+
+
+@bp_files.route('/files/stream', methods=['GET'])
+def stream_file_events():
+    """Server-Sent Events of committed tree mutations, replacing polling of /files.
+
+    Each 'tree' event carries the committed tree version and its mutations (added,
+    deleted, moved, reordered, flag, updated); its id is that version, so a reconnecting
+    client resumes from Last-Event-ID. 'resync', or a message with truncated set, means
+    events were missed: catch up with /files/changes?since=<last version>.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_version = int(last_event_id) if last_event_id else None
+    except ValueError:
+        handle_error('Last-Event-ID must be a tree version', 400)
+    return current_app.response_class(
+        subscribe(last_version),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@bp_files.route('/files/<int:file_id>/children', methods=['GET'])
+def get_file_children(file_id):
+    """Get the children of a file down to ?depth= levels (file_id 0 for the roots)"""
+    depth = request.args.get('depth', 1, type=int)
+    if depth < 1:
+        return handle_error('depth must be a positive integer', 400)
+    fmt = requested_format()
+    if fmt is None:
+        return handle_error(f"Supported formats: {', '.join(MIMETYPES)}", 406)
+    # Compact formats have a fixed column set
+    fields = requested_fields() if fmt == JSON_FORMAT else None
+
+    try:
+        tree = get_children_slice(file_id, depth, fields)
+    except SQLAlchemyError as e:
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+
+    if tree is None:
+        return handle_error('File not found', 404)
+    if fmt != JSON_FORMAT:
+        return current_app.response_class(encode_tree(tree, fmt), mimetype=MIMETYPES[fmt])
+    return jsonify({'files': tree}), 200
+
+
+@bp_files.route('/files/<int:file_id>/content', methods=['GET'])
+def get_file_content(file_id):
+    """Get the content of a single file; listings only carry its content_hash and content_size"""
+    row = db.session.query(File.content_hash).filter(File.file_id == file_id).first()
+    if row is None:
+        return handle_error('File not found', 404)
+    return jsonify({'file_id': file_id, 'file_content': read_content(row.content_hash)}), 200
+
+
+@bp_files.route('/files/<int:file_id>/content/raw', methods=['GET'])
+def get_raw_file_content(file_id):
+    """Stream the content of a file as text, with byte Range requests and the content hash as ETag"""
+    row = db.session.query(File.content_hash, File.content_size).filter(File.file_id == file_id).first()
+    if row is None:
+        return handle_error('File not found', 404)
+
+    etag = row.content_hash or 'empty'
+    if request.if_none_match.contains(etag):
+        return current_app.response_class(status=304, headers={'ETag': f'"{etag}"'})
+
+    size = row.content_size
+    start, stop, status = 0, size, 200
+    headers = {'ETag': f'"{etag}"', 'Accept-Ranges': 'bytes'}
+    # A range only applies to the body it was computed for
+    if request.range and (not request.if_range.etag or request.if_range.etag == etag):
+        requested = request.range.range_for_length(size)
+        if requested is None:
+            return current_app.response_class(status=416, headers={'Content-Range': f'bytes */{size}'})
+        start, stop = requested
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(stop - start)
+    return current_app.response_class(
+        stream_with_context(content_bytes(row.content_hash, start, stop)),
+        status=status, mimetype='text/plain', headers=headers,
+    )
+
+
+@bp_files.route('/files/<int:file_id>/content', methods=['PUT'])
+def put_file_content(file_id):
+    """Replace the content of a file with the UTF-8 request body, which may exceed any JSON-friendly size"""
+    if (request.content_length or 0) > MAX_CONTENT_BYTES:
+        return handle_error(f'Content is limited to {MAX_CONTENT_BYTES} bytes', 413)
+    file = File.query.filter_by(file_id=file_id).first()
+    if not file:
+        return handle_error('File not found', 404)
+    body = request.get_data(cache=False)
+    try:
+        body.decode('utf-8')
+    except UnicodeDecodeError:
+        return handle_error('Content must be UTF-8 text', 400)
+
+    try:
+        set_file_content(file, body)
+        queue_event('updated', file_id=file_id, content_hash=file.content_hash, content_size=file.content_size)
+        bump_tree_version()
+        db.session.commit()
+    except ContentTooLarge as e:
+        db.session.rollback()
+        return handle_error(str(e), 413)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+    return jsonify({'success': True, 'content_hash': file.content_hash, 'content_size': file.content_size}), 200
 
 
 @bp_files.route('/add-mother', methods=['POST'])
@@ -86,13 +303,19 @@ def save_items():
     try:
         items = data['items']
         new_files = []
+        row_number = next_row_number(None)
         for item in items:
             new_file = create_mother_file(item)
-            db.session.add(new_file)
-            db.session.flush()  # Generate file_id without committing
-            new_file.row_number = new_file.file_id
+            new_file.row_number = row_number
+            row_number += ROW_GAP
             new_files.append(new_file)
+        db.session.add_all(new_files)
+        db.session.flush()  # Generate the file_ids in one flush
+        for new_file in new_files:
+            assign_node_path(new_file)
 
+        queue_event('added', files=[event_file(file) for file in new_files])
+        bump_tree_version()
         db.session.commit()  # Commit all changes once
 
         return jsonify({'success': True, 'file_id': new_files[0].file_id}), 201  # Return the file_id of the first new file
@@ -108,52 +331,169 @@ def delete_file():
         return handle_error('Missing file ID', 400)
 
     try:
-        file_to_delete = File.query.filter_by(file_id=file_id).first()
-        if not file_to_delete:
-            return handle_error('File not found', 404)
-
-        # Silinmesi gereken tüm alt dosyaları al
-        def delete_children(file):
-            children = File.query.filter_by(mother_file_id=file.file_id).all()
-            for child in children:
-                delete_children(child)
-                db.session.delete(child)
-
-        # Önce alt dosyaları sil
-        delete_children(file_to_delete)
-
-        # Sonra ana dosyayı sil
-        db.session.delete(file_to_delete)
+        # Parent and descendants go in one statement; nothing is loaded into the session
+        deleted = delete_subtree(file_id)
+        if deleted:
+            queue_event('deleted', file_id=file_id, count=deleted)
+            bump_tree_version()
         db.session.commit()
-
-        return jsonify({'success': True}), 200
     except SQLAlchemyError as e:
+        db.session.rollback()
         return handle_error(f"Database error occurred: {str(e)}", 500)
     except Exception as e:
+        db.session.rollback()
         return handle_error(f"Unexpected error occurred: {str(e)}", 500)
 
+    if not deleted:
+        return handle_error('File not found', 404)
+    return jsonify({'success': True, 'deleted': deleted}), 200
+
 
 @bp_files.route('/update-files-order', methods=['POST'])
 def update_files_order():
     """Update the order of files"""
     data = request.get_json()
-    if 'files' not in data:
+    if not data or 'files' not in data:
         handle_error('No files provided', 400)
 
     try:
-        files = data['files']
-        for file in files:
-            file_id = file.get('file_id')
-            new_row_number = file.get('row_number')
-            file_to_update = File.query.filter_by(file_id=file_id).first()
-            if file_to_update and file_to_update.row_number != new_row_number:
-                file_to_update.row_number = new_row_number
+        # One statement for the whole list instead of a lookup per file
+        pairs = [(file['file_id'], file['row_number']) for file in data['files']]
+        bulk_update_row_numbers(pairs)
+        queue_event('reordered', files=pairs)
+        bump_tree_version()
         db.session.commit()
         return jsonify({'success': True}), 200
     except Exception as e:
+        db.session.rollback()
         handle_error(f"Error occurred: {str(e)}", 500)
 
 
+@bp_files.route('/files/batch', methods=['POST'])
+def batch_update_files():
+    """Apply a list of operations (update, flag, move, reorder, delete) in one transaction.
+
+    Either every operation is applied (200) or none is (400), with one result per operation.
+    """
+    data = request.get_json() or {}
+    try:
+        applied, results = apply_batch(data.get('operations'))
+        if not applied:
+            db.session.rollback()
+            return jsonify({'success': False, 'results': results}), 400
+        bump_tree_version()
+        db.session.commit()
+        return jsonify({'success': True, 'results': results}), 200
+    except BatchError as e:
+        db.session.rollback()
+        return handle_error(str(e), e.status_code)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+
+
+@bp_files.route('/files/export', methods=['GET'])
+def export_files():
+    """Stream every file, or the subtree of ?file_id=, as NDJSON with parents before children"""
+    root_id = request.args.get('file_id', type=int)
+    lines = export_lines(root_id)
+    if lines is None:
+        return handle_error('File not found', 404)
+    return current_app.response_class(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@bp_files.route('/files/import', methods=['POST'])
+def import_files():
+    """Create the files of an NDJSON request body, as new roots or under ?parent_id="""
+    parent_id = request.args.get('parent_id', type=int)
+    parent = None
+    if parent_id:
+        parent = File.query.filter_by(file_id=parent_id).first()
+        if not parent:
+            return handle_error('Parent file not found', 404)
+
+    try:
+        imported = import_tree(request.stream, parent)
+        if imported:
+            queue_event('imported', mother_file_id=parent_id or None, count=imported)
+            bump_tree_version()
+        db.session.commit()
+    except TreeImportError as e:
+        db.session.rollback()
+        return handle_error(str(e), 400)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+    return jsonify({'success': True, 'imported': imported}), 201
+
+
+def move_next_to_sibling(file_id, after):
+    """Move a file right before or after the sibling given as target_id"""
+    data = request.get_json() or {}
+    target_id = data.get('target_id')
+    if not target_id:
+        return handle_error('Missing target ID', 400)
+    if target_id == file_id:
+        return handle_error('A file can not be moved next to itself', 400)
+
+    file = File.query.filter_by(file_id=file_id).first()
+    target = File.query.filter_by(file_id=target_id).first()
+    if not file or not target:
+        return handle_error('File not found', 404)
+    if file.mother_file_id != target.mother_file_id:
+        return handle_error('Files are not siblings', 400)
+
+    try:
+        if move_next_to(file, target, after):
+            pairs = siblings_of(file.mother_file_id).with_entities(File.file_id, File.row_number).all()
+        else:
+            pairs = [(file.file_id, file.row_number)]
+        queue_event('reordered', files=[list(pair) for pair in pairs])
+        bump_tree_version()
+        db.session.commit()
+        return jsonify({'success': True, 'row_number': file.row_number}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+
+
+@bp_files.route('/files/<int:file_id>/move-before', methods=['POST'])
+def move_file_before(file_id):
+    """Move a file right before one of its siblings"""
+    return move_next_to_sibling(file_id, after=False)
+
+
+@bp_files.route('/files/<int:file_id>/move-after', methods=['POST'])
+def move_file_after(file_id):
+    """Move a file right after one of its siblings"""
+    return move_next_to_sibling(file_id, after=True)
+
+
+@bp_files.route('/files/<int:file_id>/move', methods=['POST'])
+def move_file(file_id):
+    """Move a file and its subtree under another parent (0 or null for the roots)"""
+    data = request.get_json() or {}
+    if 'mother_file_id' not in data:
+        return handle_error('Missing mother_file_id', 400)
+
+    file = File.query.filter_by(file_id=file_id).first()
+    if not file:
+        return handle_error('File not found', 404)
+
+    try:
+        moved = move_subtree(file, data['mother_file_id'] or None)
+        queue_event(
+            'moved', file_id=file_id, mother_file_id=file.mother_file_id,
+            row_number=file.row_number, count=moved,
+        )
+        bump_tree_version()
+        db.session.commit()
+        return jsonify({'success': True, 'moved': moved}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return handle_error(f"Database error occurred: {str(e)}", 500)
+
+
 @bp_files.route('/file-update/<feature>', methods=['POST'])
 def update_file(feature):
     """Update a specific feature of a file"""
@@ -184,15 +524,16 @@ def update_visibility():
     visibility = data['visibility']
     
     try:
-        file = File.query.get(file_id)
-        if file is None:
+        updated = cascade_file_feature(file_id, 'visibility', visibility)
+        if not updated:
             return jsonify({"error": "File not found"}), 404
-        
-        file.visibility = visibility
+
+        queue_event('flag', file_id=file_id, feature='visibility', value=visibility, count=updated)
+        bump_tree_version()
         db.session.commit()
-        update_children_visibility(file_id, visibility)
-        return jsonify({"message": "Visibility updated"}), 200
+        return jsonify({"message": "Visibility updated", "updated": updated}), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
     
@@ -204,15 +545,16 @@ def update_favorite():
     favorite = data['favorite']
     
     try:
-        file = File.query.get(file_id)
-        if file is None:
+        updated = cascade_file_feature(file_id, 'favorite', favorite)
+        if not updated:
             return jsonify({"error": "File not found"}), 404
-        
-        file.favorite = favorite
+
+        queue_event('flag', file_id=file_id, feature='favorite', value=favorite, count=updated)
+        bump_tree_version()
         db.session.commit()
-        update_children_favorite(file_id, favorite)
-        return jsonify({"message": "favorite updated"}), 200
+        return jsonify({"message": "favorite updated", "updated": updated}), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @bp_files.route('/file-update/disability', methods=['POST'])
@@ -223,15 +565,16 @@ def update_disability():
     disability = data['disability']
     
     try:
-        file = File.query.get(file_id)
-        if file is None:
+        updated = cascade_file_feature(file_id, 'disability', disability)
+        if not updated:
             return jsonify({"error": "File not found"}), 404
-        
-        file.disability = disability
+
+        queue_event('flag', file_id=file_id, feature='disability', value=disability, count=updated)
+        bump_tree_version()
         db.session.commit()
-        update_children_disability(file_id, disability)
-        return jsonify({"message": "Disability updated"}), 200
+        return jsonify({"message": "Disability updated", "updated": updated}), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
@@ -256,24 +599,97 @@ def add_content_file():
             file_name=file_name,
             file_type=file_type,
             mother_file_id=parent_file.file_id,
-            row_number=0,  # This will be set later based on its position
+            row_number=next_row_number(parent_file.file_id),  # Last among its siblings
             file_path=f'{parent_file.file_path}/{file_name}',
             disability='false',
             visibility='true',
             favorite='false',
-            file_content=''
         )
+        set_file_content(new_file, data.get('file_content') or '')
         db.session.add(new_file)
+        db.session.flush()  # Generate file_id for the node path
+        assign_node_path(new_file, parent_file)
+        count_new_file(new_file)
+        queue_event('added', files=[event_file(new_file)])
+        bump_tree_version()
         db.session.commit()
         return jsonify({'success': True, 'file_id': new_file.file_id}), 201
+    except ContentTooLarge as e:
+        db.session.rollback()
+        return handle_error(str(e), 413)
     except Exception as e:
         return handle_error(f"Error occurred: {str(e)}", 500)
 
 
 
+@bp_files.cli.command('rebalance-order')
+def rebalance_order_command():
+    """Spread every sibling list ROW_GAP apart again (flask files rebalance-order)"""
+    parents = db.session.query(File.mother_file_id).distinct().all()
+    for (mother_file_id,) in parents:
+        rebalance_siblings(mother_file_id)
+    queue_event('reload')
+    bump_tree_version()
+    db.session.commit()
+    logger.info(f"Rebalanced {len(parents)} sibling lists")
+
+
+@bp_files.cli.command('rebuild-tree-index')
+def rebuild_tree_index_command():
+    """Recompute node_path and depth of every file (flask files rebuild-tree-index)"""
+    rebuild_tree_index()
+    bump_tree_version()
+    db.session.commit()
+    logger.info("Tree index rebuilt")
+
+
+@bp_files.cli.command('prune-tombstones')
+@click.argument('before_version', type=int)
+def prune_tombstones_command(before_version):
+    """Forget deletions up to a tree version (flask files prune-tombstones <version>)"""
+    removed = prune_tombstones(before_version)
+    db.session.commit()
+    logger.info(f"Pruned {removed} tombstones up to version {before_version}")
+
+
+@bp_files.cli.command('gc-contents')
+def gc_contents_command():
+    """Delete the stored contents no file refers to any more (flask files gc-contents)"""
+    removed = collect_garbage()
+    db.session.commit()
+    logger.info(f"Removed {removed} unused contents")
+
+
+@bp_files.cli.command('repair-aggregates')
+@click.option('--check', is_flag=True, help='only report files with wrong aggregates')
+def repair_aggregates_command(check):
+    """Recompute every file's subtree aggregates (flask files repair-aggregates [--check])"""
+    wrong = recompute_aggregates()
+    if check:
+        db.session.rollback()
+        logger.info(f"{wrong} files have wrong aggregates")
+        if wrong:
+            raise SystemExit(1)
+        return
+    if wrong:
+        bump_tree_version()
+    db.session.commit()
+    logger.info(f"Repaired the aggregates of {wrong} files")
+
+
+@bp_files.route('/health/live', methods=['GET'])
+def liveness_check():
+    """The process serves requests; says nothing about the database"""
+    return jsonify({"status_code": 200, "detail": "ok"}), 200
+
+
 @bp_files.route('/health', methods=['GET'])
+@bp_files.route('/health/ready', methods=['GET'])
 def health_check():
-    db_status = check_postgres_connection()
+    """Ready once the database is prepared (schema current) and a pooled connection answers a query"""
+    if not is_database_ready():
+        return jsonify({"status_code": 503, "detail": "Starting: database not prepared yet"}), 503
+    db_status = check_database_connection()
 
     if db_status is True:
         return jsonify({"status_code": 200, "detail": "ok"}), 200
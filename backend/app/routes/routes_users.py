@@ -1,10 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from models import db, User
-from werkzeug.security import generate_password_hash, check_password_hash
-# from .utils import verify_password ,get_password_hash
+from .auth import HashingBusy, current_session, hash_password, issue_token, verify_password
 
 bp_users = Blueprint('users', __name__)
 
+@bp_users.errorhandler(HashingBusy)
+def hashing_busy(e):
+    return jsonify({'error': 'Too many password checks in progress, retry shortly'}), 503, {'Retry-After': '1'}
+
 @bp_users.route('/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -18,12 +21,14 @@ def register():
 
         new_user = User(
             username=data['username'],
-            password=generate_password_hash(data['password']),
+            password=hash_password(data['password']),
             user_type='user'
         )
         db.session.add(new_user)
         db.session.commit()
         return jsonify(new_user.to_dict()), 201
+    except HashingBusy:
+        raise
     except Exception as e:
         # Hata mesajını daha ayrıntılı bir şekilde döndür
         print(f"Error occurred: {e}")  # Hata mesajını konsola yazdır
@@ -32,17 +37,49 @@ def register():
 @bp_users.route('/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
-    
-    user = User.query.filter_by(username=data['username']).first()
+    if not data or 'username' not in data or 'password' not in data:
+        return jsonify({'error': 'Invalid input'}), 400
 
-    if user and check_password_hash(user.password, data['password']):
-        return jsonify({
-            'success': True,
-            'user_type': user.user_type
-        })
-    else:
+    user = User.query.filter_by(username=data['username']).first()
+    valid, new_hash = verify_password(data['password'], user.password if user else None)
+    if not valid:
         return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
 
+    if new_hash:
+        # Legacy or weaker hash, replaced now that the password is known
+        user.password = new_hash
+        db.session.commit()
+    return jsonify({
+        'success': True,
+        'user_type': user.user_type,
+        'token': issue_token(user),
+        'expires_in': current_app.config['SESSION_TOKEN_SECONDS'],
+    })
+
+@bp_users.route('/auth/session', methods=['GET'])
+def get_session():
+    """The user of the bearer token, checked without a query"""
+    session = current_session()
+    if session is None:
+        return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
+    return jsonify({'success': True, **session})
+
+@bp_users.route('/auth/refresh', methods=['POST'])
+def refresh_session():
+    """A new token for a still valid one, so active clients never log in again"""
+    session = current_session()
+    if session is None:
+        return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
+    user = db.session.get(User, session['user_id'])
+    if user is None:
+        return jsonify({'success': False, 'error': 'Invalid or expired token'}), 401
+    return jsonify({
+        'success': True,
+        'user_type': user.user_type,
+        'token': issue_token(user),
+        'expires_in': current_app.config['SESSION_TOKEN_SECONDS'],
+    })
+
 @bp_users.route('/users', methods=['GET'])
 def get_users():
     users = User.query.all()
@@ -62,7 +99,7 @@ def create_user():
 
     new_user = User(
         username=data['username'],
-        password=generate_password_hash(data['password']),
+        password=hash_password(data['password']),
         user_type=data['user_type']
     )
     db.session.add(new_user)
@@ -84,7 +121,7 @@ def update_user(user_id):
         return jsonify({'error': 'User type already exists'}), 400
 
     user.username = data['username']
-    user.password = generate_password_hash(data['password'])
+    user.password = hash_password(data['password'])
     user.user_type = data['user_type']
     db.session.commit()
     return jsonify(user.to_dict())
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import json
+from sqlalchemy import Float, and_, case, cast, func, literal, or_, select
+from models import db, ContentBlob, File
+from .utils import escape_like, file_to_dict, load_fields, path_ids
+
+SEARCH_MODES = ('contains', 'prefix')
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+
+def encode_cursor(rank, file_id):
+    """Pack the position after a hit into an opaque keyset cursor"""
+    return base64.urlsafe_b64encode(json.dumps([rank, file_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Unpack a keyset cursor, raising ValueError when it was not produced by encode_cursor"""
+    try:
+        rank, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(file_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def search_rank(term):
+    """Relevance of a file name for the term: exact match > prefix > substring, then closeness.
+
+    Postgres uses pg_trgm similarity for closeness; other databases fall back to the share
+    of the name covered by the term. The score is cast to a double so keyset cursors
+    compare exactly.
+    """
+    name = func.lower(File.file_name)
+    tier = case(
+        (name == term.lower(), 2),
+        (name.like(f'{escape_like(term.lower())}%', escape='\\'), 1),
+        else_=0,
+    )
+    if db.engine.dialect.name == 'postgresql':
+        closeness = func.similarity(File.file_name, term)
+    else:
+        closeness = literal(float(len(term))) / func.length(File.file_name)
+    return cast(tier + closeness, Float)
+
+def search_files_page(
+    term, mode='contains', limit=DEFAULT_SEARCH_LIMIT, cursor=None, include_content=False, fields=None
+):
+    """Return one page of ranked hits for a term and the cursor of the next page (or None).
+
+    Filters go through the pg_trgm indexes on Postgres; each hit carries its ancestor chain.
+    """
+    escaped = escape_like(term)
+    pattern = f'{escaped}%' if mode == 'prefix' else f'%{escaped}%'
+    criteria = File.file_name.ilike(pattern, escape='\\')
+    if include_content:
+        # Bodies are compressed in the content store; their uncompressed preview is searched
+        matching = select(ContentBlob.content_hash).where(ContentBlob.preview.ilike(f'%{escaped}%', escape='\\'))
+        criteria = or_(criteria, File.content_hash.in_(matching))
+
+    rank = search_rank(term)
+    query = load_fields(db.session.query(File, rank), fields, 'node_path').filter(criteria)
+    if cursor is not None:
+        last_rank, last_id = cursor
+        query = query.filter(or_(rank < last_rank, and_(rank == last_rank, File.file_id > last_id)))
+    rows = query.order_by(rank.desc(), File.file_id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0].file_id)
+    return attach_ancestors([file for file, _ in rows], fields), next_cursor
+
+def attach_ancestors(files, fields=None):
+    """Convert files to dicts with their ancestors (root first), loading every ancestor in one query"""
+    chains = {file.file_id: path_ids(file.node_path)[:-1] if file.node_path else [] for file in files}
+    ancestor_ids = {ancestor_id for chain in chains.values() for ancestor_id in chain}
+    names = {}
+    if ancestor_ids:
+        names = dict(
+            db.session.query(File.file_id, File.file_name).filter(File.file_id.in_(ancestor_ids))
+        )
+
+    hits = []
+    for file in files:
+        hit = file_to_dict(file, fields)
+        hit['ancestors'] = [
+            {'file_id': ancestor_id, 'file_name': names[ancestor_id]}
+            for ancestor_id in chains[file.file_id]
+            if ancestor_id in names
+        ]
+        hits.append(hit)
+    return hits
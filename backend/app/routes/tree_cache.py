@@ -0,0 +1,112 @@
+from collections import namedtuple
+import hashlib
+import threading
+from flask import current_app, jsonify, request
+from models import File
+from .utils import build_hierarchical_structure, current_tree_version, file_to_dict
+from .tree_filter import filter_tree
+from .tree_stream import begin_snapshot, compact_json, stream_tree, streamed_response, wants_stream
+from .wire_format import JSON_FORMAT, MIMETYPES, encode_tree, requested_format
+
+# One built tree per view in each worker, keyed by the view name alone: the 'filter' view keeps
+# its latest filter only, so the cache holds a handful of trees whatever the requests ask for.
+# Entries are never projected; ?fields= is cut from the cached tree on each request.
+# `tree` is shared between requests and must not be mutated.
+# `encoded` holds the compact encodings of the tree, filled on first use.
+CachedTree = namedtuple('CachedTree', ['version', 'where_key', 'tree', 'body', 'encoded'])
+
+_lock = threading.Lock()
+_entries = {}
+
+def cached_tree(view, query, where=None):
+    """Return the CachedTree of a view, rebuilding it only when the tree version or the filter changed.
+
+    A view with a TreeFilter is computed from the cached tree of all files instead of the database.
+    """
+    # Read the version before the rows: a concurrent write can then only make the rows
+    # newer than the version they are cached under, and its bump invalidates them again.
+    version = current_tree_version()
+    where_key = None if where is None else where.key
+    entry = _entries.get(view)
+    if entry is not None and entry.version == version and entry.where_key == where_key:
+        return entry
+
+    if where is None:
+        files = query.order_by(File.row_number).all()
+        tree = build_hierarchical_structure({file.file_id: file_to_dict(file) for file in files})
+    else:
+        tree = filter_tree(cached_tree('files', File.query).tree, where)
+    entry = CachedTree(version, where_key, tree, compact_json({'files': tree}).encode('utf-8'), {})
+
+    with _lock:
+        current = _entries.get(view)
+        if current is None or current.version <= version:
+            _entries[view] = entry
+    return entry
+
+def _project(tree, fields):
+    """Copy a cached tree keeping only `fields`, plus the matched mark of filtered views"""
+    projected = []
+    stack = [(node, projected) for node in reversed(tree)]
+    while stack:
+        node, siblings = stack.pop()
+        copy = {field: node[field] for field in fields}
+        copy['children'] = []
+        if 'matched' in node:
+            copy['matched'] = node['matched']
+        siblings.append(copy)
+        stack.extend((child, copy['children']) for child in reversed(node['children']))
+    return projected
+
+def _etag(view, version, fmt, fields, where):
+    parts = [view]
+    if where is not None:
+        parts.append(hashlib.sha1(repr(where.key).encode()).hexdigest()[:12])
+    if fmt != JSON_FORMAT:
+        parts.append(fmt)
+    if fields is not None:
+        parts.append('.'.join(fields))
+    return '-'.join(parts + [str(version)])
+
+def tree_response(view, query, fields=None, where=None):
+    """Serve a tree view with an ETag and answer a matching If-None-Match with 304.
+
+    The body comes from the per-worker cache, or is streamed straight from the
+    database with ?stream=1. ?format= or the Accept header select a compact encoding,
+    which has a fixed column set; `fields` only projects the JSON format. A TreeFilter
+    `where` keeps the matches of `query` with their ancestors.
+    """
+    fmt = requested_format()
+    if fmt is None:
+        return jsonify({'error': f"Supported formats: {', '.join(MIMETYPES)}"}), 406
+    if fmt != JSON_FORMAT:
+        fields = None
+
+    if fmt == JSON_FORMAT and wants_stream():
+        begin_snapshot()
+        version = current_tree_version()
+        body = None
+    else:
+        entry = cached_tree(view, query, where)
+        version, body = entry.version, entry.body
+        if fields is not None:
+            body = compact_json({'files': _project(entry.tree, fields)}).encode('utf-8')
+        elif fmt != JSON_FORMAT:
+            if fmt not in entry.encoded:
+                entry.encoded[fmt] = encode_tree(entry.tree, fmt)
+            body = entry.encoded[fmt]
+    etag = _etag(view, version, fmt, fields, where)
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    elif body is None:
+        if where is None:
+            response = streamed_response(stream_tree(query, fields))
+        else:
+            response = streamed_response(stream_tree(query, fields, where.clause, where.mark))
+    else:
+        response = current_app.response_class(body, mimetype=MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from sqlalchemy import and_
+from models import File
+from .utils import FILE_FIELDS, escape_like
+
+# Filtered views computed from the cached tree snapshot instead of a query per view.
+# A file is kept when it matches or when one of its descendants does, so matches stay
+# under their real ancestors.
+FILTER_FLAGS = ('favorite', 'visibility', 'disability')
+
+# `predicate` tests a node dict of the snapshot, `clause` is the same test in SQL for
+# streamed responses; `key` identifies the filter in the cache and ETags. With `mark`
+# every node carries 'matched', telling matches from the ancestors kept for context.
+TreeFilter = namedtuple('TreeFilter', ['key', 'predicate', 'clause', 'mark'])
+
+def parse_filter(args):
+    """Build a marked TreeFilter from ?favorite=&visibility=&disability=&name=&name_prefix=.
+
+    Flags must be "true" or "false" and are ANDed with the case-insensitive name
+    predicates; raises ValueError on bad input.
+    """
+    flags = {}
+    for flag in FILTER_FLAGS:
+        value = args.get(flag)
+        if value is None:
+            continue
+        value = value.lower()
+        if value not in ('true', 'false'):
+            raise ValueError(f'{flag} must be true or false')
+        flags[flag] = value
+    name = args.get('name', '').lower()
+    name_prefix = args.get('name_prefix', '').lower()
+    if not flags and not name and not name_prefix:
+        raise ValueError('No filter given')
+
+    def predicate(node):
+        file_name = node['file_name'].lower()
+        return (
+            all(node[flag] == value for flag, value in flags.items())
+            and name in file_name
+            and file_name.startswith(name_prefix)
+        )
+
+    clauses = [getattr(File, flag) == value for flag, value in flags.items()]
+    if name:
+        clauses.append(File.file_name.ilike(f'%{escape_like(name)}%', escape='\\'))
+    if name_prefix:
+        clauses.append(File.file_name.ilike(f'{escape_like(name_prefix)}%', escape='\\'))
+
+    key = tuple(sorted(flags.items())) + (('name', name), ('name_prefix', name_prefix))
+    return TreeFilter(key, predicate, and_(*clauses), True)
+
+def flag_filter(flag):
+    """TreeFilter of the single flag views such as /files/favorites"""
+    return TreeFilter((flag,), lambda node: node[flag] == 'true', getattr(File, flag) == 'true', False)
+
+def filter_tree(tree, where, fields=None):
+    """Return the nodes of a built tree matching a TreeFilter with their ancestor chains, in one pass.
+
+    The snapshot is not modified: kept nodes are copied and restricted to `fields`.
+    """
+    fields = fields or FILE_FIELDS
+    kept = {}
+    # Iterative post-order walk: a node is decided once all its children are
+    stack = [(node, False) for node in reversed(tree)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node['children']))
+            continue
+
+        children = [kept.pop(id(child)) for child in node['children'] if id(child) in kept]
+        matched = where.predicate(node)
+        if matched or children:
+            copy = {field: node[field] for field in fields}
+            copy['children'] = children
+            if where.mark:
+                copy['matched'] = matched
+            kept[id(node)] = copy
+
+    return [kept[id(node)] for node in tree if id(node) in kept]
@@ -0,0 +1,164 @@
+from flask import current_app, json, request, stream_with_context
+from models import db, File
+from .utils import file_to_dict, load_fields
+
+# Rows fetched per query while streaming; memory stays at one batch plus the id skeleton
+STREAM_BATCH_SIZE = 500
+
+def compact_json(data):
+    """Encode data as jsonify does outside debug mode, the form streamed bodies reproduce.
+
+    jsonify indents in debug mode; bodies that have a streamed twin (or are cached) use this
+    instead, so they stay compact and byte-for-byte equal to the stream whatever the mode.
+    """
+    return json.dumps(data, separators=(',', ':')) + '\n'
+
+def wants_stream():
+    """True when the client asked for a streamed body with ?stream=1"""
+    return request.args.get('stream', '').lower() in ('1', 'true')
+
+def begin_snapshot():
+    """Make every query of the current request read from one snapshot.
+
+    Streaming reads the tree in several passes; on Postgres they share a repeatable read
+    transaction so rows deleted or moved meanwhile can not tear the output.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+def _node_encoder():
+    """Return a function splitting a node dict into the JSON before and after its children"""
+    # Compact separators as compact_json, for nested values such as a search hit's ancestors
+    encoder = current_app.json_encoder(
+        ensure_ascii=current_app.config['JSON_AS_ASCII'], separators=(',', ':'),
+    )
+    sort_keys = current_app.config['JSON_SORT_KEYS']
+
+    def encode(node):
+        items = sorted(node.items()) if sort_keys else node.items()
+        before, after = [], []
+        parts = before
+        for key, value in items:
+            if key == 'children':
+                parts = after
+                continue
+            parts.append(f'{encoder.encode(key)}:{encoder.encode(value)}')
+        head = '{' + ''.join(part + ',' for part in before) + '"children":['
+        tail = ']' + ''.join(',' + part for part in after) + '}'
+        return head, tail
+
+    return encode
+
+def _tree_skeleton(query, where=None):
+    """Return the root ids, the child ids of every file (both in row_number order) and the matched ids.
+
+    Mirrors build_hierarchical_structure: files whose parent is not part of the query
+    are appended to the roots as orphans. With a `where` clause only the matching files
+    and their ancestors are kept, as filter_tree does.
+    """
+    children = {}
+    roots, pending = [], []
+    matched = set()
+    columns = [File.file_id, File.mother_file_id]
+    if where is not None:
+        columns.append(where.label('matched'))
+    skeleton = (
+        query.with_entities(*columns)
+        .order_by(File.row_number)
+        .yield_per(STREAM_BATCH_SIZE * 10)
+    )
+    for file_id, mother_file_id, *is_match in skeleton:
+        if is_match and is_match[0]:
+            matched.add(file_id)
+        children[file_id] = []
+        if not mother_file_id:
+            roots.append(file_id)
+        else:
+            children.setdefault(mother_file_id, None)
+            pending.append((file_id, mother_file_id))
+
+    # A parent that never showed up as a row kept its None placeholder: its children are orphans
+    for file_id, mother_file_id in pending:
+        siblings = children[mother_file_id]
+        if siblings is None:
+            roots.append(file_id)
+        else:
+            siblings.append(file_id)
+    if where is not None:
+        roots = _prune(roots, children, matched)
+    return roots, children, matched
+
+def _prune(roots, children, matched):
+    """Drop the files with no match in their subtree, returning the remaining roots"""
+    kept = set()
+    stack = [(file_id, False) for file_id in roots]
+    while stack:
+        file_id, expanded = stack.pop()
+        if not expanded:
+            stack.append((file_id, True))
+            stack.extend((child, False) for child in children[file_id])
+            continue
+        children[file_id] = [child for child in children[file_id] if child in kept]
+        if file_id in matched or children[file_id]:
+            kept.add(file_id)
+    return [file_id for file_id in roots if file_id in kept]
+
+def _preorder(roots, children):
+    """Return file ids in the order a depth-first dump of the tree visits them"""
+    order = []
+    stack = list(reversed(roots))
+    while stack:
+        file_id = stack.pop()
+        order.append(file_id)
+        stack.extend(reversed(children[file_id]))
+    return order
+
+def stream_tree(query, fields=None, where=None, mark=False):
+    """Yield the {'files': tree} document of a query chunk by chunk.
+
+    The output is byte-for-byte what compact_json produces for build_hierarchical_structure
+    (or filter_tree, given the SQL `where` of a TreeFilter) with compact separators,
+    but only the id skeleton and one batch of rows are in memory.
+    """
+    encode = _node_encoder()
+    roots, children, matched = _tree_skeleton(query, where)
+    order = _preorder(roots, children)
+
+    yield '{"files":['
+    # Each frame holds the number of children still to emit and the text closing the node
+    stack = [[len(roots), ']}\n']]
+    first = True
+    for start in range(0, len(order), STREAM_BATCH_SIZE):
+        batch = order[start:start + STREAM_BATCH_SIZE]
+        rows = {
+            file.file_id: file
+            for file in load_fields(query, fields).filter(File.file_id.in_(batch))
+        }
+        for file_id in batch:
+            node = file_to_dict(rows[file_id], fields)
+            if mark:
+                node['matched'] = file_id in matched
+            head, tail = encode(node)
+            yield head if first else ',' + head
+            stack[-1][0] -= 1
+            stack.append([len(children[file_id]), tail])
+            first = True
+            while len(stack) > 1 and stack[-1][0] == 0:
+                yield stack.pop()[1]
+                first = False
+    yield stack.pop()[1]
+
+def stream_nodes(nodes):
+    """Yield a JSON list of file dicts (as file_to_dict builds them), as compact_json would encode it"""
+    encode = _node_encoder()
+    yield '['
+    for index, node in enumerate(nodes):
+        head, tail = encode(node)
+        yield head + tail if index == 0 else ',' + head + tail
+    yield ']\n'
+
+def streamed_response(chunks, **kwargs):
+    """Wrap a chunk generator in a JSON response that keeps the request context alive"""
+    return current_app.response_class(
+        stream_with_context(chunks), mimetype='application/json', **kwargs
+    )
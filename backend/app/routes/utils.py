@@ -1,10 +1,13 @@
 from flask import abort, jsonify
 import logging
-from models import db, File
+from models import db, File, FileTombstone, TreeState
+from sqlalchemy import and_, case, cast, delete, func, insert, literal, or_, select, text, update
+from sqlalchemy.orm import aliased, load_only
 from sqlalchemy.exc import SQLAlchemyError
-import psycopg2
-from psycopg2 import OperationalError
-import os
+from werkzeug.exceptions import HTTPException
+from .content_store import ContentTooLarge, store_content
+from .events import queue_event
+from .ordering import next_row_number
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,22 +17,47 @@ def handle_error(message, status_code):
     logger.error(message)
     abort(status_code, description=message)
 
-def file_to_dict(file):
-    """Helper function to convert file to dict"""
-    return {
-        'file_id': file.file_id,
-        'file_name': file.file_name,
-        'file_type': file.file_type,
-        'mother_file': file.mother_file,
-        'mother_file_id': file.mother_file_id,
-        'row_number': file.row_number,
-        'file_path': file.file_path,
-        'disability': file.disability,
-        'visibility': file.visibility,
-        'favorite': file.favorite,
-        'file_content': file.file_content,
-        'children': []
-    }
+# Keys of a serialized file besides 'children', in their original order
+FILE_FIELDS = (
+    'file_id',
+    'file_name',
+    'file_type',
+    'mother_file',
+    'mother_file_id',
+    'row_number',
+    'file_path',
+    'disability',
+    'visibility',
+    'favorite',
+    'content_hash',
+    'content_size',
+)
+# Kept in every projection so trees can still be assembled
+STRUCTURE_FIELDS = ('file_id', 'mother_file_id')
+
+def file_to_dict(file, fields=None):
+    """Helper function to convert file to dict, restricted to `fields` when given"""
+    data = {field: getattr(file, field) for field in fields or FILE_FIELDS}
+    data['children'] = []
+    return data
+
+def parse_fields(value):
+    """Parse a ?fields=a,b projection into FILE_FIELDS order, None when no projection was asked for"""
+    if not value:
+        return None
+    requested = {field.strip() for field in value.split(',')}
+    unknown = requested.difference(FILE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(
+        field for field in FILE_FIELDS if field in requested or field in STRUCTURE_FIELDS
+    )
+
+def load_fields(query, fields, *extra):
+    """Restrict a File query to the projected columns (plus `extra`), unused ones are never read"""
+    if fields is None:
+        return query
+    return query.options(load_only(*(getattr(File, field) for field in fields + extra)))
 
 def build_hierarchical_structure(file_dict):
     """Helper function to build hierarchical structure"""
@@ -64,9 +92,14 @@ def create_mother_file(item, file_type='mother', mother_file=None, row_number=1)
         disability='true',
         visibility='true',
         favorite='false',
-        file_content=''
     )
 
+# Columns /file-update/<feature> sets as given. mother_file_id (a move), file_name (which
+# rewrites file_path below it) and file_content (the content store) are handled apart and the
+# flags have cascading routes; everything else (ids, file_path, the hierarchy index, versions,
+# aggregates) is maintained by the server
+WRITABLE_FEATURES = ('file_type', 'mother_file', 'row_number')
+
 def update_file_feature(feature, data):
     """Utility function to update file features"""
     file_id = data.get('file_id')
@@ -86,69 +119,467 @@ def update_file_feature(feature, data):
         if feature == 'mother_file_id' and new_value == 0:
             new_value = None
 
-        if hasattr(file_to_update, feature):
+        if feature == 'mother_file_id':
+            moved = move_subtree(file_to_update, new_value)
+            queue_event(
+                'moved', file_id=file_to_update.file_id, mother_file_id=new_value,
+                row_number=file_to_update.row_number, count=moved,
+            )
+            bump_tree_version()
+            db.session.commit()
+            return jsonify({'success': True}), 200
+        elif feature == 'file_content':
+            set_file_content(file_to_update, new_value)
+            queue_event(
+                'updated', file_id=file_to_update.file_id,
+                content_hash=file_to_update.content_hash, content_size=file_to_update.content_size,
+            )
+            bump_tree_version()
+            db.session.commit()
+            return jsonify({'success': True}), 200
+        elif feature == 'file_name':
+            rename_file(file_to_update, new_value)
+            queue_event(
+                'updated', file_id=file_to_update.file_id,
+                file_name=new_value, file_path=file_to_update.file_path,
+            )
+            bump_tree_version()
+            db.session.commit()
+            return jsonify({'success': True}), 200
+        elif feature in WRITABLE_FEATURES:
             setattr(file_to_update, feature, new_value)
+            queue_event('updated', file_id=file_to_update.file_id, **{feature: new_value})
+            bump_tree_version()
             db.session.commit()
             return jsonify({'success': True}), 200
         else:
             handle_error('Invalid feature name', 400)
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except ContentTooLarge as e:
+        handle_error(str(e), 413)
     except SQLAlchemyError as e:
         handle_error(f"Database error occurred: {str(e)}", 500)
     except Exception as e:
         handle_error(f"Unexpected error occurred: {str(e)}", 500)
 
-def update_children_visibility(file_id, visibility):
-    """Update visibility of all children recursively"""
-    children = File.query.filter_by(mother_file_id=file_id).all()
-    for child in children:
-        child.visibility = visibility
-        db.session.commit()
-        update_children_visibility(child.file_id, visibility)
-        
-def update_children_favorite(file_id, favorite):
-    """Update favorite of all children recursively"""
-    children = File.query.filter_by(mother_file_id=file_id).all()
-    for child in children:
-        child.favorite = favorite
-        db.session.commit()
-        update_children_favorite(child.file_id, favorite)
-
-def update_children_disability(file_id, disability):
-    """Update disability status of all children recursively"""
-    children = File.query.filter_by(mother_file_id=file_id).all()
-    for child in children:
-        child.disability = disability
-        db.session.commit()
-        update_children_disability(child.file_id, disability)
-        
-        
+TREE_STATE_ID = 1
 
-from passlib.context import CryptContext
+def bump_tree_version():
+    """Increment the tree version inside the caller's transaction.
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    Every route that changes the files table calls this before committing, so
+    caches in every worker see the new version on their next read. Files and
+    tombstones written in the transaction (row_version / version still NULL) are
+    stamped with the new version for /files/changes.
+    """
+    db.session.flush()
+    # The row is seeded with the table (migration 0002), so concurrent bumps only queue on its lock
+    db.session.execute(
+        update(TreeState)
+        .where(TreeState.id == TREE_STATE_ID)
+        .values(version=TreeState.version + 1)
+        .execution_options(synchronize_session=False)
+    )
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    version = select(TreeState.version).where(TreeState.id == TREE_STATE_ID).scalar_subquery()
+    db.session.execute(
+        update(File)
+        .where(File.row_version.is_(None))
+        .values(row_version=version, created_version=func.coalesce(File.created_version, version))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(FileTombstone)
+        .where(FileTombstone.version.is_(None))
+        .values(version=version)
+        .execution_options(synchronize_session=False)
+    )
 
+def current_tree_version():
+    """Return the committed tree version, 0 before the first mutation"""
+    version = db.session.query(TreeState.version).filter(TreeState.id == TREE_STATE_ID).scalar()
+    return version or 0
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+CASCADE_FEATURES = ('visibility', 'favorite', 'disability')
 
+def assign_node_path(file, parent=None):
+    """Set node_path and depth of a flushed file from its parent"""
+    if parent is None:
+        file.node_path = f'/{file.file_id}/'
+        file.depth = 0
+    else:
+        file.node_path = f'{parent.node_path}{file.file_id}/'
+        file.depth = parent.depth + 1
+    file.max_depth = file.depth
 
-from dotenv import load_dotenv
+def set_file_content(file, body):
+    """Point a file at the stored copy of body (text or bytes), storing it first if new"""
+    file.content_hash, file.content_size = store_content(body)
 
-dotenv_path = os.path.join(os.path.dirname(__file__),'../../../.env')
+def get_node_path(file_id):
+    """Return the materialized path of a file, or None if it does not exist"""
+    return db.session.query(File.node_path).filter(File.file_id == file_id).scalar()
 
-def check_postgres_connection():
-    try:
-        connection = psycopg2.connect(
-            dbname=os.getenv('POSTGRES_DATABASE'),
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            host=os.getenv('POSTGRES_HOST'),
-            port=os.getenv('DOCKER_POSTGRES_PORT'),
+def path_ids(node_path):
+    """Split a materialized path into the ids it contains, root first"""
+    return [int(part) for part in node_path.strip('/').split('/')]
+
+def subtree_filter(node_path, max_depth=None):
+    """WHERE clause for the file at node_path and its descendants, at most max_depth levels down"""
+    clause = File.node_path.like(f'{node_path}%')
+    if max_depth is not None:
+        clause = and_(clause, File.depth <= len(path_ids(node_path)) - 1 + max_depth)
+    return clause
+
+def query_subtree(node_path, max_depth=None):
+    """Query a file and its descendants through the node_path index"""
+    return File.query.filter(subtree_filter(node_path, max_depth))
+
+def query_ancestors(node_path):
+    """Query the ancestors of the file at node_path, root first"""
+    return File.query.filter(File.file_id.in_(path_ids(node_path)[:-1])).order_by(File.depth)
+
+def escape_like(text):
+    """Escape LIKE wildcards (with backslash) so the text only matches literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Aggregate columns, and the one counting each cascaded flag
+COUNT_FIELDS = ('descendant_count', 'favorite_descendants', 'visible_descendants')
+AGGREGATE_FIELDS = COUNT_FIELDS + ('max_depth',)
+FLAG_AGGREGATES = {'favorite': 'favorite_descendants', 'visibility': 'visible_descendants'}
+
+def subtree_totals(file_id):
+    """Return node_path, max_depth and the files / favorite / visible counts of a subtree, itself included.
+
+    None if the file does not exist. Read from the database, not from a possibly stale session object.
+    """
+    row = db.session.query(
+        File.node_path, File.max_depth, File.favorite, File.visibility,
+        File.descendant_count, File.favorite_descendants, File.visible_descendants,
+    ).filter(File.file_id == file_id).first()
+    if row is None:
+        return None
+    return {
+        'node_path': row.node_path,
+        'max_depth': row.max_depth,
+        'descendant_count': 1 + row.descendant_count,
+        'favorite_descendants': (row.favorite == 'true') + row.favorite_descendants,
+        'visible_descendants': (row.visibility == 'true') + row.visible_descendants,
+    }
+
+def add_to_ancestors(node_path, counts, max_depth=None):
+    """Add counts ({aggregate: delta}) to every ancestor of the file at node_path, in one UPDATE.
+
+    A max_depth raises theirs when deeper; lowering it needs refresh_aggregates.
+    """
+    ancestors = path_ids(node_path)[:-1]
+    if not ancestors:
+        return
+    values = {field: getattr(File, field) + delta for field, delta in counts.items()}
+    if max_depth is not None:
+        values['max_depth'] = case((File.max_depth < max_depth, max_depth), else_=File.max_depth)
+    db.session.execute(
+        update(File)
+        .where(File.file_id.in_(ancestors))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+
+def count_new_file(file):
+    """Add a newly inserted, flushed file to its ancestors' aggregates"""
+    add_to_ancestors(file.node_path, {
+        'descendant_count': 1,
+        'favorite_descendants': int(file.favorite == 'true'),
+        'visible_descendants': int(file.visibility == 'true'),
+    }, file.depth)
+
+def _children_aggregates():
+    """Aggregates of a file computed from its children's, as correlated subqueries"""
+    child = aliased(File)
+
+    def over_children(expression):
+        return select(expression).where(child.mother_file_id == File.file_id).scalar_subquery()
+
+    def flagged(flag):
+        return case((getattr(child, flag) == 'true', 1), else_=0)
+
+    return {
+        'descendant_count': over_children(func.coalesce(func.sum(child.descendant_count + 1), 0)),
+        'favorite_descendants': over_children(
+            func.coalesce(func.sum(child.favorite_descendants + flagged('favorite')), 0)
+        ),
+        'visible_descendants': over_children(
+            func.coalesce(func.sum(child.visible_descendants + flagged('visibility')), 0)
+        ),
+        'max_depth': func.coalesce(over_children(func.max(child.max_depth)), File.depth),
+    }
+
+def refresh_aggregates(file_ids, until_unchanged=False):
+    """Recompute the aggregates of the given files from their children, one UPDATE each.
+
+    file_ids must come deepest first. With until_unchanged the walk stops at the first
+    file that was already right, which is enough for an ancestor chain.
+    """
+    aggregates = _children_aggregates()
+    for file_id in file_ids:
+        result = db.session.execute(
+            update(File)
+            .where(
+                File.file_id == file_id,
+                or_(*(getattr(File, field) != value for field, value in aggregates.items())),
+            )
+            .values(aggregates)
+            .execution_options(synchronize_session=False)
+        )
+        if until_unchanged and not result.rowcount:
+            break
+
+def recompute_aggregates(scope=None):
+    """Recompute the aggregates of every file (or of those matching scope), deepest level first.
+
+    One UPDATE per level; returns the number of files whose aggregates were wrong.
+    """
+    aggregates = _children_aggregates()
+    depths = db.session.query(func.min(File.depth), func.max(File.depth))
+    if scope is not None:
+        depths = depths.filter(scope)
+    lowest, deepest = depths.one()
+    if deepest is None:
+        return 0
+
+    changed = 0
+    for depth in range(deepest, lowest - 1, -1):
+        criteria = [
+            File.depth == depth,
+            or_(*(getattr(File, field) != value for field, value in aggregates.items())),
+        ]
+        if scope is not None:
+            criteria.append(scope)
+        result = db.session.execute(
+            update(File).where(*criteria).values(aggregates).execution_options(synchronize_session=False)
+        )
+        changed += result.rowcount
+    return changed
+
+def move_subtree(file, new_parent_id):
+    """Re-parent a file, rewriting node_path, depth and file_path of its whole subtree in one UPDATE.
+
+    The cycle check compares materialized paths, so it costs one primary key lookup.
+    A file changing parent goes last among its new siblings. The subtree's aggregates move
+    from the old ancestors to the new ones. Returns the number of rows moved.
+    """
+    if new_parent_id is None:
+        new_path, new_depth, new_file_path = f'/{file.file_id}/', 0, f'/{file.file_name}'
+    else:
+        parent = File.query.filter_by(file_id=new_parent_id).first()
+        if not parent:
+            handle_error('Parent file not found', 404)
+        if parent.node_path.startswith(file.node_path):
+            handle_error('A file can not be moved under itself or its descendants', 400)
+        new_path, new_depth = f'{parent.node_path}{file.file_id}/', parent.depth + 1
+        new_file_path = f'{parent.file_path}/{file.file_name}'
+
+    old_path, old_file_path = file.node_path, file.file_path
+    totals = subtree_totals(file.file_id)
+    counts = {field: totals[field] for field in COUNT_FIELDS}
+    shift = new_depth - file.depth
+    add_to_ancestors(old_path, {field: -count for field, count in counts.items()})
+
+    result = db.session.execute(
+        update(File)
+        .where(subtree_filter(old_path))
+        .values(
+            node_path=literal(new_path) + func.substr(File.node_path, len(old_path) + 1),
+            depth=File.depth + shift,
+            max_depth=File.max_depth + shift,
+            file_path=_rewritten_file_path(old_file_path, new_file_path),
+            row_version=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    add_to_ancestors(new_path, counts, totals['max_depth'] + shift)
+
+    old_parent_id = file.mother_file_id
+    db.session.expire(file)
+    file.mother_file_id = new_parent_id
+    if old_parent_id != new_parent_id:
+        file.row_number = next_row_number(new_parent_id)
+        # The old ancestors may have lost their deepest branch, once the file left them
+        db.session.flush()
+        refresh_aggregates(reversed(path_ids(old_path)[:-1]), until_unchanged=True)
+    return result.rowcount
+
+def _rewritten_file_path(old_file_path, new_file_path):
+    """SQL expression moving file_path from under old_file_path to under new_file_path"""
+    # Rows whose file_path was set by hand before it became read-only may not share the
+    # prefix; they are left alone
+    under_old_file_path = or_(
+        File.file_path == old_file_path,
+        File.file_path.like(f'{escape_like(old_file_path)}/%', escape='\\'),
+    )
+    return case(
+        (under_old_file_path, literal(new_file_path) + func.substr(File.file_path, len(old_file_path) + 1)),
+        else_=File.file_path,
+    )
+
+def rename_file(file, new_name):
+    """Rename a file, rewriting the file_path of its whole subtree in one UPDATE as a move does.
+
+    The paths are read from the database rather than the session, so renames of nested
+    files in one transaction compose. Returns the number of rows rewritten.
+    """
+    node_path, old_file_path = (
+        db.session.query(File.node_path, File.file_path).filter(File.file_id == file.file_id).one()
+    )
+    parent_file_path = db.session.query(File.file_path).filter(File.file_id == file.mother_file_id).scalar()
+    new_file_path = f'{parent_file_path or ""}/{new_name}'
+
+    result = db.session.execute(
+        update(File)
+        .where(subtree_filter(node_path))
+        .values(file_path=_rewritten_file_path(old_file_path, new_file_path), row_version=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.expire(file)
+    file.file_name = new_name
+    return result.rowcount
+
+def rebuild_tree_index():
+    """Recompute node_path and depth of every file from mother_file_id, one UPDATE per level"""
+    parent = aliased(File)
+    db.session.execute(
+        update(File).values(node_path=None, depth=0).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(File)
+        .where(File.mother_file_id.is_(None))
+        .values(node_path=literal('/') + cast(File.file_id, db.Text) + '/')
+        .execution_options(synchronize_session=False)
+    )
+    depth = 0
+    while True:
+        parent_path = (
+            select(parent.node_path)
+            .where(parent.file_id == File.mother_file_id)
+            .scalar_subquery()
+        )
+        level = select(parent.file_id).where(parent.depth == depth, parent.node_path.isnot(None))
+        result = db.session.execute(
+            update(File)
+            .where(File.node_path.is_(None), File.mother_file_id.in_(level))
+            .values(node_path=parent_path + cast(File.file_id, db.Text) + '/', depth=depth + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            break
+        depth += 1
+
+def get_children_slice(file_id, depth, fields=None):
+    """Return the children of a file (0 for the roots) down to `depth` levels, or None if it does not exist.
+
+    Every node carries a child_count and the subtree aggregates, so nodes on the last level
+    can be expanded on demand and show what they contain without loading it.
+    """
+    if file_id:
+        node_path = get_node_path(file_id)
+        if node_path is None:
+            return None
+        criteria = and_(subtree_filter(node_path, depth), File.file_id != file_id)
+    else:
+        criteria = File.depth < depth
+
+    child = aliased(File)
+    child_count = (
+        select(func.count(child.file_id))
+        .where(child.mother_file_id == File.file_id)
+        .scalar_subquery()
+    )
+    rows = (
+        load_fields(db.session.query(File, child_count), fields, 'depth', 'row_number', *AGGREGATE_FIELDS)
+        .filter(criteria)
+        .order_by(File.depth, File.row_number)
+        .all()
+    )
+
+    # Rows come level by level, so a parent is always placed before its children
+    nodes = {}
+    tree = []
+    for file, count in rows:
+        node = file_to_dict(file, fields)
+        node['child_count'] = count
+        node.update((field, getattr(file, field)) for field in AGGREGATE_FIELDS)
+        nodes[file.file_id] = node
+        parent = nodes.get(file.mother_file_id)
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            tree.append(node)
+    return tree
+
+def cascade_file_feature(file_id, feature, value):
+    """Set a flag on a file and its whole subtree in a single UPDATE, then adjust the ancestors' aggregates.
+
+    Runs inside the caller's transaction and returns the number of rows touched,
+    so 0 means the file does not exist.
+    """
+    if feature not in CASCADE_FEATURES:
+        raise ValueError(f'Feature {feature} can not be cascaded')
+
+    totals = subtree_totals(file_id)
+    if totals is None:
+        return 0
+
+    values = {feature: value, 'row_version': None}
+    aggregate = FLAG_AGGREGATES.get(feature)
+    if aggregate is not None:
+        # The whole subtree now has the same flag, every file's count follows its descendant_count
+        flagged = str(value).lower() == 'true'
+        values[aggregate] = File.descendant_count if flagged else 0
+    result = db.session.execute(
+        update(File)
+        .where(subtree_filter(totals['node_path']))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if aggregate is not None:
+        delta = (totals['descendant_count'] if flagged else 0) - totals[aggregate]
+        if delta:
+            add_to_ancestors(totals['node_path'], {aggregate: delta})
+    return result.rowcount
+
+def delete_subtree(file_id):
+    """Delete a file and all of its descendants in a single DELETE, then adjust the ancestors' aggregates.
+
+    Runs inside the caller's transaction and returns the number of rows deleted,
+    so 0 means the file does not exist.
+    """
+    totals = subtree_totals(file_id)
+    if totals is None:
+        return 0
+    node_path = totals['node_path']
+
+    # Tombstones are stamped with the new version by bump_tree_version
+    db.session.execute(
+        insert(FileTombstone).from_select(
+            ['file_id'], select(File.file_id).where(subtree_filter(node_path))
         )
-        connection.close()
+    )
+    result = db.session.execute(
+        delete(File)
+        .where(subtree_filter(node_path))
+        .execution_options(synchronize_session=False)
+    )
+    add_to_ancestors(node_path, {field: -totals[field] for field in COUNT_FIELDS})
+    refresh_aggregates(reversed(path_ids(node_path)[:-1]), until_unchanged=True)
+    return result.rowcount
+
+def check_database_connection():
+    """Run a trivial query on a connection of the app's pool; True, or the error message"""
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
         return True
-    except OperationalError as e:
+    except SQLAlchemyError as e:
         return str(e)
\ No newline at end of file
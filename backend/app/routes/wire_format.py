@@ -0,0 +1,82 @@
+import json
+from flask import request
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for ?format=msgpack
+    msgpack = None
+
+# Compact tree encodings. Instead of nested dicts repeating every key, the tree is sent as
+# parallel arrays in depth-first order; a node's parent is the mother_file_id entry, or a
+# root when that id is not part of the payload. The content fields, file_path and mother_file
+# are left out, the flags are packed into one integer.
+JSON_FORMAT = 'json'
+COLUMNAR_FORMAT = 'columnar'
+MSGPACK_FORMAT = 'msgpack'
+
+MIMETYPES = {
+    JSON_FORMAT: 'application/json',
+    COLUMNAR_FORMAT: 'application/vnd.treeapp.columnar+json',
+    MSGPACK_FORMAT: 'application/vnd.treeapp.columnar+msgpack',
+}
+
+FLAG_BITS = (('disability', 1), ('visibility', 2), ('favorite', 4))
+
+def requested_format():
+    """Return the wire format asked for with ?format= or the Accept header, or None if unsupported"""
+    fmt = request.args.get('format')
+    if fmt is None:
+        accepted = request.accept_mimetypes.best_match(list(MIMETYPES.values()), default=MIMETYPES[JSON_FORMAT])
+        fmt = next(name for name, mimetype in MIMETYPES.items() if mimetype == accepted)
+    if fmt not in MIMETYPES or (fmt == MSGPACK_FORMAT and msgpack is None):
+        return None
+    return fmt
+
+def pack_flags(node):
+    """Pack the "true"/"false" flags of a node into a bitmask"""
+    return sum(bit for name, bit in FLAG_BITS if node[name] == 'true')
+
+def columnar_tree(tree):
+    """Flatten a built tree into parallel arrays, depth first"""
+    columns = {
+        'file_id': [],
+        'mother_file_id': [],
+        'row_number': [],
+        'file_name': [],
+        'file_type': [],
+        'flags': [],
+    }
+    # Children slices also carry the child count and the subtree aggregates
+    extra = [
+        name for name in ('child_count', 'descendant_count', 'favorite_descendants', 'visible_descendants', 'max_depth')
+        if tree and name in tree[0]
+    ]
+    for name in extra:
+        columns[name] = []
+
+    stack = list(reversed(tree))
+    while stack:
+        node = stack.pop()
+        columns['file_id'].append(node['file_id'])
+        columns['mother_file_id'].append(node['mother_file_id'])
+        columns['row_number'].append(node['row_number'])
+        columns['file_name'].append(node['file_name'])
+        columns['file_type'].append(node['file_type'])
+        columns['flags'].append(pack_flags(node))
+        for name in extra:
+            columns[name].append(node[name])
+        stack.extend(reversed(node['children']))
+
+    return {
+        'format': COLUMNAR_FORMAT,
+        'flag_bits': dict(FLAG_BITS),
+        'count': len(columns['file_id']),
+        'columns': columns,
+    }
+
+def encode_tree(tree, fmt):
+    """Encode a built tree in a compact format, returning the body bytes"""
+    document = columnar_tree(tree)
+    if fmt == MSGPACK_FORMAT:
+        return msgpack.packb(document)
+    return json.dumps(document, separators=(',', ':')).encode()
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask import current_app
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from models import db
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where other databases go unlocked
+    fcntl = None
+
+# Database preparation of a worker: wait for the database with bounded exponential
+# backoff, then bring the schema to the head migration. Workers starting together
+# serialize on a lock (a Postgres advisory lock, a lock file elsewhere) and whoever
+# comes after the first finds the schema current and stops after one query.
+# Until this is done /health/ready answers 503; servers that never prepare (flask run,
+# test clients) are ready once the schema is found current.
+
+BACKOFF_START_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 5
+# Any constant shared by every worker; keys the Postgres advisory lock
+MIGRATION_LOCK_KEY = 7_306_123_941
+
+logger = logging.getLogger(__name__)
+
+class UnknownSchema(Exception):
+    """An unversioned schema that matches no migration revision"""
+
+def wait_for_database(engine, timeout):
+    """Return once a connection answers, retrying with exponential backoff for up to timeout seconds"""
+    deadline = time.monotonic() + timeout
+    delay = BACKOFF_START_SECONDS
+    while True:
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            return
+        except DBAPIError as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.warning(f"Database not reachable, retrying in {delay:.1f} s: {e.orig}")
+            time.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX_SECONDS)
+
+class _MigrationLock:
+    """Held by one worker at a time while it checks and upgrades the schema"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self.lock_file = None
+
+    def __enter__(self):
+        if self.engine.dialect.name == 'postgresql':
+            self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+            self.connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        elif fcntl is not None:
+            name = hashlib.sha1(str(self.engine.url).encode()).hexdigest()[:12]
+            self.lock_file = open(os.path.join(tempfile.gettempdir(), f'treeapp-migrate-{name}.lock'), 'w')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.connection is not None:
+            self.connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            self.connection.close()
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+
+def detect_revision(connection):
+    """Revision of a schema built by db.create_all() without alembic_version, or None.
+
+    create_all never altered an existing table, so the files table tells which model
+    built the database; the newest revision whose changes it carries is the answer.
+    """
+    inspector = inspect(connection)
+    columns = {column['name'] for column in inspector.get_columns('files')}
+    indexes = {index['name'] for index in inspector.get_indexes('files')}
+    if 'content_hash' in columns:
+        return '0005'
+    if 'descendant_count' in columns:
+        return '0004'
+    if 'ix_files_mother_row' in indexes:
+        return '0003'
+    if {'node_path', 'depth', 'row_version', 'created_version'} <= columns:
+        return '0002'
+    if 'node_path' not in columns:
+        return '0001'
+    # node_path without the change log columns: a model from between two revisions
+    return None
+
+def _head_revisions():
+    migrate = current_app.extensions['migrate'].migrate
+    return set(ScriptDirectory.from_config(migrate.get_config()).get_heads())
+
+def apply_migrations():
+    """Upgrade the schema to the head revision unless it already is there; returns True if it ran"""
+    heads = _head_revisions()
+    engine = db.engine
+    with _MigrationLock(engine):
+        with engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+            tables = set(inspect(connection).get_table_names())
+        if current == heads:
+            return False
+        if not current and 'files' in tables:
+            # Created by db.create_all() before the app applied migrations
+            with engine.connect() as connection:
+                revision = detect_revision(connection)
+            if revision is None:
+                raise UnknownSchema(
+                    'The unversioned schema matches no migration revision: bring it to one '
+                    'by hand and record it with flask db stamp <revision>'
+                )
+            logger.warning(f'Unversioned schema found, stamping it as {revision} before upgrading')
+            stamp(revision=revision)
+        upgrade()
+        return True
+
+def prepare_database(app):
+    """Wait for the database and migrate it, in the app's context; sets app's readiness when done"""
+    ready = app.extensions['database_ready']
+    with app.app_context():
+        started = time.monotonic()
+        wait_for_database(db.engine, app.config['DB_STARTUP_TIMEOUT'])
+        if app.config['MIGRATE_ON_START']:
+            migrated = apply_migrations()
+            logger.info(f"Schema {'upgraded' if migrated else 'current'} in {time.monotonic() - started:.2f} s")
+        ready.set()
+
+def is_database_ready():
+    """Whether the app's database is prepared: set by prepare_database, or found so here.
+
+    Without MIGRATE_ON_START there is nothing to wait for; otherwise the schema must be at
+    the head revision. Once true, the answer is kept.
+    """
+    ready = current_app.extensions['database_ready']
+    if not ready.is_set():
+        try:
+            if not current_app.config['MIGRATE_ON_START']:
+                ready.set()
+            else:
+                with db.engine.connect() as connection:
+                    current = set(MigrationContext.configure(connection).get_current_heads())
+                if current == _head_revisions():
+                    ready.set()
+        except SQLAlchemyError:
+            pass
+    return ready.is_set()
+
+def start_database_preparation(app):
+    """Prepare the database in the background, so the worker serves /health/live meanwhile"""
+    def run():
+        try:
+            prepare_database(app)
+        except Exception as e:
+            logger.error(f"Database preparation failed, staying unready: {str(e)}")
+
+    thread = threading.Thread(target=run, name='database-preparation', daemon=True)
+    thread.start()
+    return thread
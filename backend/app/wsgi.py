@@ -0,0 +1,11 @@
+"""WSGI entry point of the production server (see gunicorn.conf.py)"""
+from app import create_app
+from config import Config
+from startup import start_database_preparation
+
+if not Config.SECRET_KEY:
+    # Even with FLASK_DEBUG: each worker would make up its own key
+    raise RuntimeError('SECRET_KEY must be set for the production server: every worker signs session tokens with it')
+app = create_app()
+# Workers answer /health/live at once and /health/ready when the schema is current
+start_database_preparation(app)
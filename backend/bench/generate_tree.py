@@ -0,0 +1,111 @@
+"""Synthetic file hierarchy for benchmarks.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python bench/generate_tree.py --nodes 100000 --fanout 8 --depth 6
+
+Fills the files table of the configured database (SQLite or Postgres) breadth first until
+either the node count or the depth is reached, with deterministic names and flags per seed.
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from sqlalchemy import func, text  # noqa: E402
+from models import db, File  # noqa: E402
+from routes.ordering import ROW_GAP  # noqa: E402
+from routes.utils import bump_tree_version, recompute_aggregates  # noqa: E402
+
+WORDS = (
+    'report', 'invoice', 'draft', 'notes', 'budget', 'design', 'summary', 'backup',
+    'archive', 'contract', 'photo', 'plan', 'review', 'release', 'meeting', 'index',
+)
+INSERT_BATCH_SIZE = 5000
+
+def _node_name(rng, file_id):
+    return f'{rng.choice(WORDS)}-{rng.choice(WORDS)}-{file_id}'
+
+def generate_tree(nodes, fanout, depth, seed=0, favorite_ratio=0.1, hidden_ratio=0.1):
+    """Insert a tree of at most `nodes` files, `fanout` children per file and `depth` levels.
+
+    Must run inside an app context; returns the ids of the generated roots.
+    """
+    rng = random.Random(seed)
+    next_id = (db.session.query(func.max(File.file_id)).scalar() or 0) + 1
+    root_count = max(1, min(fanout, nodes))
+    batch, created = [], 0
+
+    def add(parent, level, position):
+        nonlocal next_id, created
+        file_id = next_id
+        next_id += 1
+        created += 1
+        name = _node_name(rng, file_id)
+        row = {
+            'file_id': file_id,
+            'file_name': name,
+            'file_type': 'mother' if parent is None else 'content',
+            'file_path': f"{parent['file_path'] if parent else ''}/{name}",
+            'disability': 'false',
+            'visibility': 'false' if rng.random() < hidden_ratio else 'true',
+            'favorite': 'true' if rng.random() < favorite_ratio else 'false',
+            'mother_file': '',
+            'mother_file_id': parent['file_id'] if parent else None,
+            'row_number': (position + 1) * ROW_GAP,
+            'node_path': f"{parent['node_path'] if parent else '/'}{file_id}/",
+            'depth': level,
+        }
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            flush()
+        return row
+
+    def flush():
+        if batch:
+            db.session.execute(File.__table__.insert(), batch)
+            batch.clear()
+
+    level_rows = [add(None, 0, position) for position in range(root_count)]
+    root_ids = [row['file_id'] for row in level_rows]
+    for level in range(1, depth):
+        next_level = []
+        for parent in level_rows:
+            for position in range(fanout):
+                if created >= nodes:
+                    break
+                next_level.append(add(parent, level, position))
+        level_rows = next_level
+        if not level_rows:
+            break
+    flush()
+
+    # Explicit ids do not advance the Postgres sequence behind file_id
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('files', 'file_id'), (SELECT max(file_id) FROM files))"
+        ))
+    recompute_aggregates()
+    bump_tree_version()
+    db.session.commit()
+    return root_ids
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from app import create_app
+    from startup import prepare_database
+    app = create_app()
+    prepare_database(app)
+    with app.app_context():
+        roots = generate_tree(args.nodes, args.fanout, args.depth, seed=args.seed)
+        total = db.session.query(func.count(File.file_id)).scalar()
+    print(f'Generated {len(roots)} roots, {total} files in total')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Benchmark every files endpoint against a synthetic tree.
+
+    python bench/run_benchmarks.py --nodes 20000 --output bench-results.json
+    python bench/run_benchmarks.py --nodes 20000 --baseline bench-results.json
+
+Each run starts from a fresh database (a temporary SQLite file, or DATABASE_URL with --reset),
+loads a generated tree, then drives the routes through the Flask test client. Results
+(p50/p99 latency, throughput, SQL statements and bytes per request) are printed as JSON.
+With --baseline the run is compared to a stored result and exits with status 1 when a
+scenario's p50 regressed by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+class Bench:
+    """Runs scenarios against the app while counting the SQL statements they issue"""
+
+    def __init__(self, app):
+        from sqlalchemy import event
+        from models import db
+
+        self.app = app
+        self.client = app.test_client()
+        self.queries = 0
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def count_query(*args):
+            self.queries += 1
+
+    def run(self, name, iterations, request, setup=None):
+        """Time `request(client)` after an untimed `setup()` for each iteration"""
+        latencies, bytes_sent, queries = [], [], []
+        for _ in range(iterations):
+            if setup is not None:
+                setup()
+            self.queries = 0
+            started = time.perf_counter()
+            response = request(self.client)
+            body = response.get_data()
+            latencies.append(time.perf_counter() - started)
+            queries.append(self.queries)
+            bytes_sent.append(len(body))
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: HTTP {response.status_code} {body[:200]!r}')
+
+        return {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'throughput_rps': round(iterations / sum(latencies), 1),
+            'queries_per_request': round(statistics.mean(queries), 1),
+            'bytes_per_request': round(statistics.mean(bytes_sent)),
+        }
+
+def scenarios(app, roots):
+    """Return (name, request, setup) for every benchmarked route"""
+    from models import db, File
+    from routes.utils import bump_tree_version
+
+    root = roots[0]
+    with app.app_context():
+        children = [
+            file_id for (file_id,) in
+            db.session.query(File.file_id).filter_by(mother_file_id=root).order_by(File.row_number)
+        ]
+        order = [
+            {'file_id': file_id, 'row_number': row_number}
+            for file_id, row_number in db.session.query(File.file_id, File.row_number)
+            .filter_by(mother_file_id=root)
+        ]
+
+    def invalidate():
+        with app.app_context():
+            bump_tree_version()
+            db.session.commit()
+
+    created = []
+    toggle = {'value': 'false'}
+
+    def new_subtree():
+        client = app.test_client()
+        response = client.post('/add-content', json={
+            'parent_id': root, 'file_name': 'bench-subtree', 'file_type': 'content',
+        })
+        parent_id = response.get_json()['file_id']
+        for index in range(10):
+            client.post('/add-content', json={
+                'parent_id': parent_id, 'file_name': f'bench-leaf-{index}', 'file_type': 'content',
+            })
+        created.append(parent_id)
+
+    def cascade(client):
+        toggle['value'] = 'true' if toggle['value'] == 'false' else 'false'
+        return client.post('/file-update/visibility', json={'file_id': root, 'visibility': toggle['value']})
+
+    return [
+        ('files_cached', lambda c: c.get('/files'), None),
+        ('files_cold', lambda c: c.get('/files'), invalidate),
+        ('files_stream', lambda c: c.get('/files?stream=1'), None),
+        ('favorites_cold', lambda c: c.get('/files/favorites'), invalidate),
+        ('visible_cold', lambda c: c.get('/files/visible'), invalidate),
+        ('filter_cold', lambda c: c.get('/files/filter?favorite=true&visibility=true&disability=false'), invalidate),
+        ('children_depth2', lambda c: c.get(f'/files/{root}/children?depth=2'), None),
+        ('search_contains', lambda c: c.get('/search_files?query=report'), None),
+        ('search_prefix', lambda c: c.get('/search_files?query=rep&mode=prefix'), None),
+        ('cascade_visibility', cascade, None),
+        ('reorder_siblings', lambda c: c.post('/update-files-order', json={'files': order}), None),
+        ('move_before', lambda c: c.post(
+            f'/files/{children[-1]}/move-before', json={'target_id': children[0]}
+        ), None),
+        ('add_mother', lambda c: c.post('/add-mother', json={'items': ['bench-root']}), None),
+        ('add_content', lambda c: c.post('/add-content', json={
+            'parent_id': root, 'file_name': 'bench-file', 'file_type': 'content',
+        }), None),
+        ('delete_subtree', lambda c: c.delete('/delete-file', json={'file_id': created.pop()}), new_subtree),
+    ]
+
+def compare(results, baseline, tolerance):
+    """Return the scenarios whose p50 grew by more than `tolerance` over the baseline"""
+    regressions = {}
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous and previous['p50_ms'] and result['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions[name] = {'baseline_p50_ms': previous['p50_ms'], 'p50_ms': result['p50_ms']}
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--only', action='append', help='run only these scenarios')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 growth, 0.2 = 20%%')
+    parser.add_argument('--reset', action='store_true', help='allow dropping the tables of DATABASE_URL')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' in os.environ and not args.reset:
+        parser.error('DATABASE_URL is set: pass --reset to drop and reload its tables')
+    workdir = tempfile.mkdtemp(prefix='treeapp-bench-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    from app import create_app
+    from generate_tree import generate_tree
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        roots = generate_tree(args.nodes, args.fanout, args.depth, seed=args.seed)
+        dialect = db.engine.dialect.name
+
+    bench = Bench(app)
+    results = {
+        'config': {
+            'database': dialect,
+            'nodes': args.nodes,
+            'fanout': args.fanout,
+            'depth': args.depth,
+            'seed': args.seed,
+            'iterations': args.iterations,
+        },
+        'scenarios': {},
+    }
+    for name, request, setup in scenarios(app, roots):
+        if args.only and name not in args.only:
+            continue
+        results['scenarios'][name] = bench.run(name, args.iterations, request, setup)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results['regressions'] = compare(results, json.load(baseline_file), args.tolerance)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+    return 1 if results.get('regressions') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
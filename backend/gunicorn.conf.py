@@ -0,0 +1,29 @@
+"""gunicorn settings of the production server.
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+
+gevent workers serve each connection in a greenlet instead of a thread, so thousands of
+idle keep-alive connections, /files/stream subscribers and slow streamed tree downloads
+cost memory, not a worker each. psycopg2 is made cooperative, so a request waiting on
+Postgres lets the others run. Queries still go through each worker's pool, which bounds
+database concurrency at WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+"""
+import multiprocessing
+import os
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app')
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gevent'
+# Simultaneous connections per worker, streams included
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '2000'))
+keepalive = 75
+# gevent workers notify the arbiter from their own greenlet, so long streams do not time out
+timeout = 30
+graceful_timeout = 30
+accesslog = '-'
+
+def post_fork(server, worker):
+    # Before the worker imports the app and opens any connection
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
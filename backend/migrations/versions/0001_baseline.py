@@ -0,0 +1,49 @@
+"""Baseline schema: users and files as originally created by db.create_all()
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=False),
+        sa.Column('password', sa.String(length=255), nullable=False),
+        sa.Column('user_type', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_table(
+        'files',
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('file_name', sa.String(length=50), nullable=False),
+        sa.Column('file_type', sa.String(length=10), nullable=False),
+        sa.Column('file_path', sa.String(length=50), nullable=False),
+        sa.Column('disability', sa.String(length=5), nullable=False),
+        sa.Column('visibility', sa.String(length=5), nullable=False),
+        sa.Column('favorite', sa.String(length=5), nullable=False),
+        sa.Column('file_content', sa.String(length=500), nullable=False),
+        sa.Column('mother_file', sa.String(length=50), nullable=True),
+        sa.Column('mother_file_id', sa.Integer(), nullable=True),
+        sa.Column('row_number', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['mother_file_id'], ['files.file_id']),
+        sa.PrimaryKeyConstraint('file_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('files')
+    op.drop_table('users')
@@ -0,0 +1,85 @@
+"""Tree index, version counter, change log and search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.alter_column('file_path', type_=sa.String(length=1024), existing_nullable=False)
+        batch_op.add_column(sa.Column('node_path', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('row_version', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('created_version', sa.BigInteger(), nullable=True))
+
+    # Materialized paths of the existing rows, walking down from the roots
+    op.execute("""
+        WITH RECURSIVE paths (file_id, node_path, depth) AS (
+            SELECT file_id, '/' || CAST(file_id AS TEXT) || '/', 0
+            FROM files WHERE mother_file_id IS NULL
+            UNION ALL
+            SELECT files.file_id, paths.node_path || CAST(files.file_id AS TEXT) || '/', paths.depth + 1
+            FROM files JOIN paths ON files.mother_file_id = paths.file_id
+        )
+        UPDATE files SET
+            node_path = (SELECT node_path FROM paths WHERE paths.file_id = files.file_id),
+            depth = COALESCE((SELECT depth FROM paths WHERE paths.file_id = files.file_id), 0)
+    """)
+
+    op.create_index(
+        'ix_files_node_path', 'files', ['node_path'],
+        postgresql_ops={'node_path': 'text_pattern_ops'},
+    )
+    op.create_index('ix_files_row_version', 'files', ['row_version'])
+    if is_postgres:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_files_file_name_trgm ON files USING gin (file_name gin_trgm_ops)')
+        op.execute('CREATE INDEX ix_files_file_content_trgm ON files USING gin (file_content gin_trgm_ops)')
+
+    tree_state = op.create_table(
+        'tree_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('pruned_version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # The single counter row; bump_tree_version only ever updates it
+    op.bulk_insert(tree_state, [{'id': 1, 'version': 0, 'pruned_version': 0}])
+    op.create_table(
+        'file_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_file_tombstones_version', 'file_tombstones', ['version'])
+
+
+def downgrade():
+    op.drop_index('ix_file_tombstones_version', table_name='file_tombstones')
+    op.drop_table('file_tombstones')
+    op.drop_table('tree_state')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_files_file_content_trgm', table_name='files')
+        op.drop_index('ix_files_file_name_trgm', table_name='files')
+    op.drop_index('ix_files_row_version', table_name='files')
+    op.drop_index('ix_files_node_path', table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('created_version')
+        batch_op.drop_column('row_version')
+        batch_op.drop_column('depth')
+        batch_op.drop_column('node_path')
+        batch_op.alter_column('file_path', type_=sa.String(length=50), existing_nullable=False)
@@ -0,0 +1,68 @@
+"""Boolean flag columns, parent/order index and partial favorite/visible indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00
+
+disability, visibility and favorite are converted in place from the "true"/"false"
+strings; anything else becomes false.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+FLAGS = ('disability', 'visibility', 'favorite')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for flag in FLAGS:
+            op.alter_column(
+                'files', flag, type_=sa.Boolean(), existing_nullable=False,
+                postgresql_using=f"{flag} = 'true'",
+            )
+    else:
+        # Other databases get the new values first, then the table is rebuilt with the new types
+        op.execute(
+            'UPDATE files SET '
+            + ', '.join(f"{flag} = CASE WHEN {flag} = 'true' THEN 1 ELSE 0 END" for flag in FLAGS)
+        )
+        with op.batch_alter_table('files') as batch_op:
+            for flag in FLAGS:
+                batch_op.alter_column(flag, type_=sa.Boolean(), existing_nullable=False)
+
+    op.create_index('ix_files_mother_row', 'files', ['mother_file_id', 'row_number'])
+    op.create_index(
+        'ix_files_favorite', 'files', ['mother_file_id', 'row_number'],
+        postgresql_where=sa.text('favorite'), sqlite_where=sa.text('favorite'),
+    )
+    op.create_index(
+        'ix_files_visible', 'files', ['mother_file_id', 'row_number'],
+        postgresql_where=sa.text('visibility'), sqlite_where=sa.text('visibility'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_files_visible', table_name='files')
+    op.drop_index('ix_files_favorite', table_name='files')
+    op.drop_index('ix_files_mother_row', table_name='files')
+    if op.get_bind().dialect.name == 'postgresql':
+        for flag in FLAGS:
+            op.alter_column(
+                'files', flag, type_=sa.String(length=5), existing_nullable=False,
+                postgresql_using=f"CASE WHEN {flag} THEN 'true' ELSE 'false' END",
+            )
+    else:
+        with op.batch_alter_table('files') as batch_op:
+            for flag in FLAGS:
+                batch_op.alter_column(flag, type_=sa.String(length=5), existing_nullable=False)
+        op.execute(
+            'UPDATE files SET '
+            + ', '.join(f"{flag} = CASE WHEN {flag} THEN 'true' ELSE 'false' END" for flag in FLAGS)
+        )
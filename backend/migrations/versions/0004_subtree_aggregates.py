@@ -0,0 +1,54 @@
+"""Per-file subtree aggregates
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:30:00
+
+descendant_count, favorite_descendants, visible_descendants and max_depth are filled
+from the children, deepest level first, so each level reads finished values.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+AGGREGATES = ('descendant_count', 'favorite_descendants', 'visible_descendants', 'max_depth')
+
+
+def upgrade():
+    with op.batch_alter_table('files') as batch_op:
+        for column in AGGREGATES:
+            batch_op.add_column(sa.Column(column, sa.Integer(), nullable=False, server_default='0'))
+
+    deepest = op.get_bind().execute(sa.text('SELECT max(depth) FROM files')).scalar()
+    for depth in range(deepest or 0, -1, -1):
+        op.execute(sa.text("""
+            UPDATE files SET
+                descendant_count = COALESCE((
+                    SELECT sum(child.descendant_count + 1)
+                    FROM files AS child WHERE child.mother_file_id = files.file_id
+                ), 0),
+                favorite_descendants = COALESCE((
+                    SELECT sum(child.favorite_descendants + CASE WHEN child.favorite THEN 1 ELSE 0 END)
+                    FROM files AS child WHERE child.mother_file_id = files.file_id
+                ), 0),
+                visible_descendants = COALESCE((
+                    SELECT sum(child.visible_descendants + CASE WHEN child.visibility THEN 1 ELSE 0 END)
+                    FROM files AS child WHERE child.mother_file_id = files.file_id
+                ), 0),
+                max_depth = COALESCE((
+                    SELECT max(child.max_depth) FROM files AS child WHERE child.mother_file_id = files.file_id
+                ), files.depth)
+            WHERE depth = :depth
+        """).bindparams(depth=depth))
+
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        for column in reversed(AGGREGATES):
+            batch_op.drop_column(column)
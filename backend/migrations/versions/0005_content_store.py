@@ -0,0 +1,140 @@
+"""Content store: file bodies out of the files rows, deduplicated and compressed
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 09:40:00
+
+Every non-empty file_content is moved to content_blobs / content_chunks under its
+SHA-256 before the column is dropped. The downgrade puts the first 500 characters back.
+"""
+import hashlib
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# Same layout as routes/content_store.py
+CHUNK_SIZE = 64 * 1024
+PREVIEW_CHARS = 500
+BATCH_SIZE = 1000
+
+blobs = sa.table(
+    'content_blobs',
+    sa.column('content_hash', sa.String),
+    sa.column('size', sa.BigInteger),
+    sa.column('preview', sa.Text),
+)
+chunks = sa.table(
+    'content_chunks',
+    sa.column('content_hash', sa.String),
+    sa.column('chunk_index', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+)
+files = sa.table(
+    'files',
+    sa.column('file_id', sa.Integer),
+    sa.column('file_content', sa.String),
+    sa.column('content_hash', sa.String),
+    sa.column('content_size', sa.BigInteger),
+)
+
+
+def _move_contents(bind):
+    stored = set()
+    point = (
+        files.update()
+        .where(files.c.file_id == sa.bindparam('b_file_id'))
+        .values(content_hash=sa.bindparam('b_content_hash'), content_size=sa.bindparam('b_content_size'))
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(files.c.file_id, files.c.file_content)
+            .where(files.c.file_id > last_id, files.c.file_content != '')
+            .order_by(files.c.file_id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].file_id
+        new_blobs, new_chunks, pointers = [], [], []
+        for file_id, content in rows:
+            data = content.encode('utf-8')
+            content_hash = hashlib.sha256(data).hexdigest()
+            if content_hash not in stored:
+                stored.add(content_hash)
+                new_blobs.append({'content_hash': content_hash, 'size': len(data), 'preview': content[:PREVIEW_CHARS]})
+                new_chunks.extend(
+                    {'content_hash': content_hash, 'chunk_index': index, 'data': zlib.compress(data[offset:offset + CHUNK_SIZE])}
+                    for index, offset in enumerate(range(0, len(data), CHUNK_SIZE))
+                )
+            pointers.append({'b_file_id': file_id, 'b_content_hash': content_hash, 'b_content_size': len(data)})
+        if new_blobs:
+            bind.execute(blobs.insert(), new_blobs)
+            bind.execute(chunks.insert(), new_chunks)
+        bind.execute(point, pointers)
+
+
+def upgrade():
+    bind = op.get_bind()
+    is_postgres = bind.dialect.name == 'postgresql'
+
+    op.create_table(
+        'content_blobs',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('preview', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('content_hash'),
+    )
+    op.create_table(
+        'content_chunks',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('chunk_index', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['content_hash'], ['content_blobs.content_hash']),
+        sa.PrimaryKeyConstraint('content_hash', 'chunk_index'),
+    )
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('content_size', sa.BigInteger(), nullable=False, server_default='0'))
+
+    _move_contents(bind)
+
+    if is_postgres:
+        op.execute('DROP INDEX IF EXISTS ix_files_file_content_trgm')
+        op.execute('CREATE INDEX ix_content_blobs_preview_trgm ON content_blobs USING gin (preview gin_trgm_ops)')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('file_content')
+        batch_op.create_foreign_key(
+            'fk_files_content_hash', 'content_blobs', ['content_hash'], ['content_hash'],
+        )
+        batch_op.create_index('ix_files_content_hash', ['content_hash'])
+
+
+def downgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index('ix_files_content_hash')
+        batch_op.drop_constraint('fk_files_content_hash', type_='foreignkey')
+        batch_op.add_column(sa.Column('file_content', sa.String(length=500), nullable=False, server_default=''))
+    # Bodies longer than the old column are cut to it
+    op.execute("""
+        UPDATE files SET file_content = COALESCE((
+            SELECT preview FROM content_blobs WHERE content_blobs.content_hash = files.content_hash
+        ), '')
+    """)
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('content_size')
+        batch_op.drop_column('content_hash')
+    if is_postgres:
+        op.execute('CREATE INDEX ix_files_file_content_trgm ON files USING gin (file_content gin_trgm_ops)')
+    op.drop_table('content_chunks')
+    op.drop_table('content_blobs')
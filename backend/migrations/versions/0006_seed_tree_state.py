@@ -0,0 +1,29 @@
+"""Seed the tree_state counter row
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:00:00
+
+0002 now creates the row with the table; databases migrated before that got it lazily
+on their first write, or have no row yet.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        'INSERT INTO tree_state (id, version, pruned_version) '
+        'SELECT 1, 0, 0 WHERE NOT EXISTS (SELECT 1 FROM tree_state WHERE id = 1)'
+    )
+
+
+def downgrade():
+    # The row is what 0002 creates as well; nothing to undo
+    pass
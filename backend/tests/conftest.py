@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+# The app imports its modules flat (from models import db), as when run from backend/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+# Read when config is imported; every test then points the app at its own SQLite file
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+
+from app import create_app  # noqa: E402
+from models import db, File  # noqa: E402
+from routes import tree_cache  # noqa: E402
+from routes.utils import path_ids, recompute_aggregates  # noqa: E402
+from startup import prepare_database  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App on a fresh SQLite database, migrated to the head revision"""
+    app = create_app()
+    app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'tree.db'}")
+    # Built trees are cached per tree version in the process, which every new database restarts
+    tree_cache._entries.clear()
+    prepare_database(app)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_roots(client, *names):
+    """Create root files, returning their ids"""
+    response = client.post('/add-mother', json={'items': list(names)})
+    assert response.status_code == 201, response.data
+    first = response.get_json()['file_id']
+    return list(range(first, first + len(names)))
+
+
+def add_child(client, parent_id, name, file_content=''):
+    """Create a content file under parent_id, returning its id"""
+    response = client.post('/add-content', json={
+        'parent_id': parent_id, 'file_name': name, 'file_type': 'content', 'file_content': file_content,
+    })
+    assert response.status_code == 201, response.data
+    return response.get_json()['file_id']
+
+
+@pytest.fixture
+def tree(client):
+    """Two roots; ids by name:
+
+        a ── b ── d
+        │    └─── e
+        └─── c ── f
+        g
+    """
+    ids = dict(zip('ag', add_roots(client, 'a', 'g')))
+    ids['b'] = add_child(client, ids['a'], 'b')
+    ids['c'] = add_child(client, ids['a'], 'c')
+    ids['d'] = add_child(client, ids['b'], 'd', 'body of d')
+    ids['e'] = add_child(client, ids['b'], 'e')
+    ids['f'] = add_child(client, ids['c'], 'f')
+    return ids
+
+
+def assert_tree_consistent(app):
+    """Check node_path, depth and every subtree aggregate against the parent links"""
+    with app.app_context():
+        files = {file.file_id: file for file in File.query}
+        for file in files.values():
+            parent = files.get(file.mother_file_id)
+            expected = f'{parent.node_path}{file.file_id}/' if parent else f'/{file.file_id}/'
+            assert file.node_path == expected, file.file_id
+            assert file.depth == len(path_ids(file.node_path)) - 1, file.file_id
+        try:
+            assert recompute_aggregates() == 0, 'stale subtree aggregates'
+        finally:
+            db.session.rollback()
+
+
+@pytest.fixture
+def check_tree(app):
+    return lambda: assert_tree_consistent(app)
@@ -0,0 +1,92 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from models import db, User
+
+
+@pytest.fixture
+def user(client):
+    response = client.post('/api/auth/register', json={'username': 'ayse', 'password': 'secret'})
+    assert response.status_code == 201, response.data
+    return response.get_json()
+
+
+def login(client, password='secret', username='ayse'):
+    return client.post('/api/auth/login', json={'username': username, 'password': password})
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def stored_hash(app, username='ayse'):
+    with app.app_context():
+        return User.query.filter_by(username=username).one().password
+
+
+def test_register_stores_a_passlib_hash(app, user):
+    assert stored_hash(app).startswith('$pbkdf2-sha256$')
+
+
+def test_login_issues_a_token_for_the_session(app, client, user):
+    response = login(client)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['expires_in'] == app.config['SESSION_TOKEN_SECONDS']
+    session = client.get('/api/auth/session', headers=bearer(body['token'])).get_json()
+    assert (session['user_id'], session['user_type']) == (user['user_id'], 'user')
+
+
+@pytest.mark.parametrize('username, password', [('ayse', 'wrong'), ('nobody', 'secret')])
+def test_bad_credentials(client, user, username, password):
+    response = login(client, password, username)
+    assert response.status_code == 401
+    assert 'token' not in response.get_json()
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'Authorization': 'Bearer forged.token.value'},
+    {'Authorization': 'Basic abc'},
+])
+def test_session_needs_a_valid_token(client, user, headers):
+    assert client.get('/api/auth/session', headers=headers).status_code == 401
+
+
+def test_expired_token_is_refused_and_can_not_be_refreshed(app, client, user):
+    token = login(client).get_json()['token']
+    app.config['SESSION_TOKEN_SECONDS'] = -1
+
+    assert client.get('/api/auth/session', headers=bearer(token)).status_code == 401
+    assert client.post('/api/auth/refresh', headers=bearer(token)).status_code == 401
+
+
+def test_refresh_issues_a_new_valid_token(client, user):
+    token = login(client).get_json()['token']
+
+    response = client.post('/api/auth/refresh', headers=bearer(token))
+
+    assert response.status_code == 200
+    refreshed = response.get_json()['token']
+    assert client.get('/api/auth/session', headers=bearer(refreshed)).get_json()['user_id'] == user['user_id']
+
+
+def test_refresh_of_a_deleted_user_is_refused(client, user):
+    token = login(client).get_json()['token']
+    assert client.delete(f"/api/users/{user['user_id']}").status_code == 204
+    assert client.post('/api/auth/refresh', headers=bearer(token)).status_code == 401
+
+
+def test_legacy_werkzeug_hash_is_replaced_on_login(app, client):
+    legacy = generate_password_hash('secret', method='pbkdf2:sha256')
+    with app.app_context():
+        db.session.add(User(username='ayse', password=legacy, user_type='user'))
+        db.session.commit()
+
+    assert login(client, 'wrong').status_code == 401
+    assert stored_hash(app) == legacy
+
+    assert login(client).status_code == 200
+    assert stored_hash(app).startswith('$pbkdf2-sha256$')
+    assert login(client).status_code == 200
@@ -0,0 +1,98 @@
+import pytest
+
+from models import File
+from routes import batch as batch_module
+
+
+def batch(client, *operations):
+    return client.post('/files/batch', json={'operations': list(operations)})
+
+
+def snapshot(app):
+    with app.app_context():
+        return {
+            file.file_id: (file.file_name, file.file_type, file.mother_file_id, file.row_number, file.favorite)
+            for file in File.query
+        }
+
+
+def test_mixed_operations_apply_in_one_transaction(app, client, tree, check_tree):
+    version = client.get('/files/changes?since=0').get_json()['version']
+
+    response = batch(
+        client,
+        {'op': 'update', 'file_id': tree['c'], 'feature': 'file_type', 'value': 'folder'},
+        {'op': 'flag', 'file_id': tree['b'], 'feature': 'favorite', 'value': 'true'},
+        {'op': 'move', 'file_id': tree['f'], 'mother_file_id': tree['g']},
+        {'op': 'reorder', 'file_id': tree['c'], 'row_number': 1},
+        {'op': 'delete', 'file_id': tree['e']},
+    )
+
+    assert response.status_code == 200, response.data
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == [200] * 5
+    assert (results[2]['moved'], results[4]['deleted']) == (1, 1)
+    files = snapshot(app)
+    assert files[tree['c']][1] == 'folder'
+    assert (files[tree['b']][4], files[tree['d']][4]) == ('true', 'true')
+    assert files[tree['f']][2] == tree['g']
+    assert tree['e'] not in files
+    assert [child['file_name'] for child in client.get(f"/files/{tree['a']}/children").get_json()['files']] == ['c', 'b']
+    # One tree version for the whole batch
+    assert client.get('/files/changes?since=0').get_json()['version'] == version + 1
+    check_tree()
+
+
+@pytest.mark.parametrize('operation, status, error', [
+    ({'op': 'rename', 'file_id': 1}, 400, 'op must be one of'),
+    ({'op': 'delete', 'file_id': 999}, 404, 'File not found'),
+    ({'op': 'update', 'file_id': 1, 'feature': 'favorite', 'value': 'true'}, 400, 'feature must be one of'),
+    ({'op': 'update', 'file_id': 1, 'feature': 'file_type'}, 400, 'Missing value'),
+    ({'op': 'flag', 'file_id': 1, 'feature': 'favorite', 'value': 'yes'}, 400, 'value must be'),
+    ({'op': 'move', 'file_id': 1, 'mother_file_id': 999}, 404, 'Parent file not found'),
+    ({'op': 'reorder', 'file_id': 1, 'row_number': '3'}, 400, 'row_number must be an integer'),
+])
+def test_invalid_operation_rejects_the_batch(app, client, tree, operation, status, error):
+    before = snapshot(app)
+
+    response = batch(client, {'op': 'delete', 'file_id': tree['g']}, operation)
+
+    assert response.status_code == 400
+    results = response.get_json()['results']
+    assert results[0] == {'status': 200}
+    assert results[1]['status'] == status
+    assert error in results[1]['error']
+    assert snapshot(app) == before
+
+
+def test_failed_move_rolls_back_earlier_operations(app, client, tree, check_tree):
+    before = snapshot(app)
+
+    response = batch(
+        client,
+        {'op': 'update', 'file_id': tree['a'], 'feature': 'file_type', 'value': 'folder'},
+        {'op': 'move', 'file_id': tree['a'], 'mother_file_id': tree['d']},
+    )
+
+    assert response.status_code == 400
+    results = response.get_json()['results']
+    assert results[1]['status'] == 400
+    assert 'under itself' in results[1]['error']
+    assert snapshot(app) == before
+    check_tree()
+
+
+@pytest.mark.parametrize('body', [{}, {'operations': []}, {'operations': 'x'}])
+def test_batch_needs_operations(client, body):
+    response = client.post('/files/batch', json=body)
+    assert response.status_code == 400
+    assert 'non-empty list' in response.data.decode()
+
+
+def test_batch_size_is_bounded(client, tree, monkeypatch):
+    monkeypatch.setattr(batch_module, 'MAX_BATCH_OPERATIONS', 2)
+
+    response = batch(client, *({'op': 'delete', 'file_id': tree[name]} for name in 'deg'))
+
+    assert response.status_code == 400
+    assert 'At most 2 operations' in response.data.decode()
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+
+def ndjson(*lines):
+    return ''.join(json.dumps(line) + '\n' for line in lines)
+
+
+def import_document(client, body, **args):
+    query = ''.join(f'&{key}={value}' for key, value in args.items())
+    return client.post(f'/files/import?{query}', data=body, content_type='application/x-ndjson')
+
+
+def export_lines(client, **args):
+    query = ''.join(f'&{key}={value}' for key, value in args.items())
+    response = client.get(f'/files/export?{query}')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+def shape(lines):
+    """The document without its ids: each line's fields and the position of its parent"""
+    position = {line['id']: index for index, line in enumerate(lines)}
+    return [
+        (position.get(line['parent']), {key: value for key, value in line.items() if key not in ('id', 'parent')})
+        for line in lines
+    ]
+
+
+def test_export_import_round_trip(client, tree, check_tree):
+    exported = export_lines(client, file_id=tree['a'])
+    assert [line['file_name'] for line in exported[:3]] == ['a', 'b', 'c']
+    assert next(line for line in exported if line['file_name'] == 'd')['file_content'] == 'body of d'
+
+    response = import_document(client, ndjson(*exported), parent_id=tree['g'])
+
+    assert response.status_code == 201
+    assert response.get_json()['imported'] == 6
+    copy_id = client.get(f"/files/{tree['g']}/children").get_json()['files'][0]['file_id']
+    assert shape(export_lines(client, file_id=copy_id)) == shape(exported)
+    check_tree()
+
+
+def test_import_normalises_flags(client, check_tree):
+    response = import_document(client, ndjson(
+        {'id': 1, 'file_name': 'x', 'favorite': True, 'visibility': False},
+        {'id': 2, 'parent': 1, 'file_name': 'y', 'disability': 'TRUE', 'favorite': 'False'},
+    ))
+
+    assert response.status_code == 201
+    root = client.get('/files').get_json()['files'][0]
+    assert (root['favorite'], root['visibility'], root['disability']) == ('true', 'false', 'false')
+    child = root['children'][0]
+    assert (child['favorite'], child['disability'], child['visibility']) == ('false', 'true', 'true')
+    check_tree()
+
+
+@pytest.mark.parametrize('lines, message', [
+    ([{'id': 1, 'file_name': 'x', 'favorite': 'yes'}], 'favorite must be true or false'),
+    ([{'id': 1, 'file_name': 'x', 'visibility': 1}], 'visibility must be true or false'),
+    ([{'id': 1, 'file_name': 'x'}, {'id': 2, 'parent': 3, 'file_name': 'y'}], 'not in the document'),
+    ([{'id': 1, 'file_name': 'x'}, {'id': 1, 'file_name': 'y'}], 'more than once'),
+    ([{'id': 1, 'parent': 2, 'file_name': 'x'}, {'id': 2, 'parent': 1, 'file_name': 'y'}], 'cycle'),
+    ([{'id': 1}], 'id and file_name are required'),
+])
+def test_invalid_documents_import_nothing(client, tree, lines, message):
+    before = client.get('/files').data
+
+    response = import_document(client, ndjson(*lines))
+
+    assert response.status_code == 400
+    assert message in response.data.decode()
+    assert client.get('/files').data == before
+
+
+def test_import_under_unknown_parent(client):
+    response = import_document(client, ndjson({'id': 1, 'file_name': 'x'}), parent_id=999)
+    assert response.status_code == 404
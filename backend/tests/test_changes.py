@@ -0,0 +1,82 @@
+import random
+
+from conftest import add_child, add_roots
+
+
+def changes(client, since):
+    response = client.get(f'/files/changes?since={since}')
+    assert response.status_code == 200, response.data
+    return response.get_json()
+
+
+def flat_files(client):
+    """Every file of /files by id, without the children lists"""
+    files, stack = {}, list(client.get('/files').get_json()['files'])
+    while stack:
+        node = stack.pop()
+        stack.extend(node.pop('children'))
+        files[node['file_id']] = node
+    return files
+
+
+def apply_delta(replica, delta):
+    """Apply a /files/changes answer to a client's copy, deletions first"""
+    for file_id in delta['deleted']:
+        replica.pop(file_id, None)
+    for file in delta['inserted'] + delta['updated']:
+        replica[file['file_id']] = file
+    return delta['version']
+
+
+def test_changes_classify_inserts_updates_and_deletes(client, tree):
+    version = changes(client, 0)['version']
+
+    new_id = add_child(client, tree['g'], 'h')
+    client.post('/file-update/file_name', json={'file_id': tree['c'], 'file_name': 'c2'})
+    client.delete('/delete-file', json={'file_id': tree['b']})
+    delta = changes(client, version)
+
+    assert delta['version'] == version + 3
+    assert [file['file_id'] for file in delta['inserted']] == [new_id]
+    # The rename rewrote the file_path of c's subtree as well
+    updated = {file['file_id']: file for file in delta['updated']}
+    assert sorted(updated) == [tree['c'], tree['f']]
+    assert updated[tree['c']]['file_name'] == 'c2'
+    assert updated[tree['f']]['file_path'] == '/a/c2/f'
+    assert delta['deleted'] == sorted(tree[name] for name in 'bde')
+    assert changes(client, delta['version'])['inserted'] == []
+
+
+def test_changes_from_the_future_are_gone(client, tree):
+    version = changes(client, 0)['version']
+    assert client.get(f'/files/changes?since={version + 1}').status_code == 410
+    assert client.get('/files/changes?since=x').status_code == 400
+
+
+def test_replica_follows_the_tree(client):
+    """A client applying each delta to its copy ends up with what /files serves"""
+    rng = random.Random(15)
+    ids = add_roots(client, 'r0', 'r1')
+    replica = {}
+    version = apply_delta(replica, changes(client, 0))
+
+    for step in range(60):
+        target = rng.choice(ids)
+        op = rng.choice(['add', 'delete', 'move', 'flag', 'rename'])
+        if op == 'add':
+            add_child(client, target, f'n{step}')
+        elif op == 'delete' and len(ids) > 2:
+            client.delete('/delete-file', json={'file_id': target})
+        elif op == 'move':
+            client.post(f'/files/{target}/move', json={'mother_file_id': rng.choice(ids + [0])})
+        elif op == 'flag':
+            client.post('/file-update/favorite', json={'file_id': target, 'favorite': rng.choice(['true', 'false'])})
+        elif op == 'rename':
+            client.post('/file-update/file_name', json={'file_id': target, 'file_name': f'x{step}'})
+
+        if step % 3 == 2:
+            version = apply_delta(replica, changes(client, version))
+        ids = list(flat_files(client)) or add_roots(client, f'r{step}')
+
+    apply_delta(replica, changes(client, version))
+    assert replica == flat_files(client)
@@ -0,0 +1,55 @@
+import pytest
+
+
+def children(client, file_id, **args):
+    query = ''.join(f'&{key}={value}' for key, value in args.items())
+    response = client.get(f'/files/{file_id}/children?{query}')
+    assert response.status_code == 200, response.data
+    return response.get_json()['files']
+
+
+def names(nodes):
+    return [node['file_name'] for node in nodes]
+
+
+def test_one_level_with_child_counts(client, tree):
+    nodes = children(client, tree['a'])
+
+    assert names(nodes) == ['b', 'c']
+    assert [node['child_count'] for node in nodes] == [2, 1]
+    assert all(node['children'] == [] for node in nodes)
+    # max_depth is the depth of the deepest file below, counted from the roots
+    assert (nodes[0]['descendant_count'], nodes[0]['max_depth']) == (2, 2)
+
+
+def test_roots_and_deeper_slices(client, tree):
+    roots = children(client, 0)
+    assert names(roots) == ['a', 'g']
+    assert [root['child_count'] for root in roots] == [2, 0]
+
+    nodes = children(client, tree['a'], depth=2)
+    assert [names(node['children']) for node in nodes] == [['d', 'e'], ['f']]
+    assert [node['child_count'] for node in nodes[0]['children']] == [0, 0]
+
+
+def test_projection_keeps_counts(client, tree):
+    nodes = children(client, tree['b'], fields='file_name')
+    assert set(nodes[0]) >= {'file_id', 'mother_file_id', 'file_name', 'child_count', 'children'}
+    assert 'file_type' not in nodes[0]
+
+
+def test_child_count_follows_writes(client, tree):
+    client.post(f"/files/{tree['f']}/move", json={'mother_file_id': tree['b']})
+    client.delete('/delete-file', json={'file_id': tree['d']})
+
+    nodes = children(client, tree['a'])
+    assert [node['child_count'] for node in nodes] == [2, 0]
+    assert names(children(client, tree['b'])) == ['e', 'f']
+
+
+@pytest.mark.parametrize('url, status', [
+    ('/files/999/children', 404),
+    ('/files/1/children?depth=0', 400),
+])
+def test_invalid_slices(client, tree, url, status):
+    assert client.get(url).status_code == status
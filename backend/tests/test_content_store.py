@@ -0,0 +1,110 @@
+import pytest
+from sqlalchemy import text
+
+from models import db
+from routes import routes_files
+from routes.content_store import CHUNK_SIZE
+
+# Three chunks and a bit, with a multi-byte character across the first boundary
+BODY = ('x' * (CHUNK_SIZE - 1) + 'ü' + ''.join(str(index % 10) for index in range(2 * CHUNK_SIZE + 100))).encode()
+
+
+def put(client, file_id, body):
+    return client.put(f'/files/{file_id}/content', data=body, content_type='text/plain; charset=utf-8')
+
+
+def raw(client, file_id, **headers):
+    return client.get(f'/files/{file_id}/content/raw', headers=headers)
+
+
+def count(app, table):
+    with app.app_context():
+        return db.session.execute(text(f'SELECT count(*) FROM {table}')).scalar()
+
+
+@pytest.fixture
+def large(client, tree):
+    response = put(client, tree['e'], BODY)
+    assert response.status_code == 200, response.data
+    assert response.get_json()['content_size'] == len(BODY)
+    return tree['e']
+
+
+def test_large_body_round_trips(client, large):
+    assert raw(client, large).data == BODY
+    assert client.get(f'/files/{large}/content').get_json()['file_content'] == BODY.decode()
+
+
+@pytest.mark.parametrize('header, start, stop', [
+    ('bytes=0-9', 0, 10),
+    (f'bytes={CHUNK_SIZE - 5}-{CHUNK_SIZE + 5}', CHUNK_SIZE - 5, CHUNK_SIZE + 6),
+    (f'bytes={2 * CHUNK_SIZE}-', 2 * CHUNK_SIZE, len(BODY)),
+    ('bytes=-100', len(BODY) - 100, len(BODY)),
+])
+def test_byte_ranges(client, large, header, start, stop):
+    response = raw(client, large, Range=header)
+
+    assert response.status_code == 206
+    assert response.data == BODY[start:stop]
+    assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(BODY)}'
+    assert response.headers['Content-Length'] == str(stop - start)
+
+
+def test_unsatisfiable_range(client, large):
+    response = raw(client, large, Range=f'bytes={len(BODY)}-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(BODY)}'
+
+
+def test_conditional_requests_follow_the_content_hash(client, large):
+    etag = raw(client, large).headers['ETag']
+
+    assert raw(client, large, **{'If-None-Match': etag}).status_code == 304
+    # A range computed for another body gets the whole current one
+    stale = raw(client, large, Range='bytes=0-9', **{'If-Range': '"other"'})
+    assert (stale.status_code, stale.data) == (200, BODY)
+    assert raw(client, large, Range='bytes=0-9', **{'If-Range': etag}).status_code == 206
+
+    put(client, large, b'changed')
+    assert raw(client, large, **{'If-None-Match': etag}).status_code == 200
+
+
+def test_identical_bodies_are_stored_once(app, client, tree, large):
+    put(client, tree['f'], BODY)
+
+    with app.app_context():
+        hashes = db.session.execute(
+            text('SELECT content_hash FROM files WHERE file_id IN (:e, :f)'), {'e': large, 'f': tree['f']}
+        ).scalars().all()
+    assert len(hashes) == 2 and hashes[0] == hashes[1]
+    # BODY in four chunks, plus "body of d" from the fixture
+    assert count(app, 'content_blobs') == 2
+    assert count(app, 'content_chunks') == 4 + 1
+
+
+def test_put_over_the_limit_is_refused(client, tree, monkeypatch):
+    monkeypatch.setattr(routes_files, 'MAX_CONTENT_BYTES', 10)
+
+    response = put(client, tree['e'], b'x' * 11)
+
+    assert response.status_code == 413
+    assert raw(client, tree['e']).data == b''
+
+
+def test_put_needs_utf8_and_an_existing_file(client, tree):
+    assert put(client, tree['e'], b'\xff\xfe').status_code == 400
+    assert put(client, 999, b'x').status_code == 404
+
+
+def test_gc_removes_only_unreferenced_bodies(app, client, tree, large):
+    put(client, tree['f'], BODY)
+    put(client, large, b'replaced')
+    client.delete('/delete-file', json={'file_id': tree['d']})
+
+    result = app.test_cli_runner().invoke(args=['files', 'gc-contents'])
+
+    assert result.exit_code == 0, result.output
+    # BODY is still used by f, "replaced" by e; "body of d" went with d
+    assert count(app, 'content_blobs') == 2
+    assert raw(client, tree['f']).data == BODY
+    assert raw(client, large).data == b'replaced'
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from conftest import add_child
+from routes import events
+
+
+@pytest.fixture(autouse=True)
+def broker(monkeypatch):
+    """A fresh broker per test: the module's one outlives the databases of earlier tests"""
+    monkeypatch.setattr(events, 'broker', events.EventBroker(size=5))
+    monkeypatch.setattr(events, 'KEEPALIVE_SECONDS', 0.05)
+    return events.broker
+
+
+def parse(chunk):
+    """Fields of one SSE message, with data decoded"""
+    fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines() if not line.startswith(':'))
+    if 'data' in fields:
+        fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+class Subscriber:
+    def __init__(self, client, **headers):
+        self.response = client.get('/files/stream', headers=headers, buffered=False)
+        self.chunks = iter(self.response.response)
+
+    def next_message(self):
+        """The next message that is not a keep-alive"""
+        while True:
+            chunk = next(self.chunks)
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if not chunk.startswith((':', 'retry:')):
+                return parse(chunk)
+
+    def close(self):
+        self.response.close()
+
+
+@pytest.fixture
+def subscribe(client):
+    subscribers = []
+
+    def subscribe(**headers):
+        subscribers.append(Subscriber(client, **headers))
+        return subscribers[-1]
+
+    yield subscribe
+    for subscriber in subscribers:
+        subscriber.close()
+
+
+def test_live_events_carry_the_committed_version(client, tree, subscribe):
+    subscriber = subscribe()
+    ready = subscriber.next_message()
+    assert ready['event'] == 'ready'
+
+    new_id = add_child(client, tree['g'], 'h')
+    message = subscriber.next_message()
+
+    assert message['event'] == 'tree'
+    assert int(message['id']) == message['data']['version'] == ready['data']['version'] + 1
+    assert message['data']['events'][0]['type'] == 'added'
+    assert message['data']['events'][0]['files'][0]['file_id'] == new_id
+
+
+def test_reconnect_replays_missed_messages(client, tree, subscribe):
+    version = client.get('/files/changes?since=0').get_json()['version']
+    client.post('/file-update/favorite', json={'file_id': tree['d'], 'favorite': 'true'})
+    client.delete('/delete-file', json={'file_id': tree['f']})
+
+    subscriber = subscribe(**{'Last-Event-ID': str(version)})
+
+    assert subscriber.next_message()['data'] == {'version': version + 2}
+    replayed = [subscriber.next_message() for _ in range(2)]
+    assert [int(message['id']) for message in replayed] == [version + 1, version + 2]
+    assert [message['data']['events'][0]['type'] for message in replayed] == ['flag', 'deleted']
+
+
+def test_reconnect_past_the_buffer_asks_for_a_resync(client, tree, subscribe):
+    # The fixture's seven writes overflowed the five message buffer
+    subscriber = subscribe(**{'Last-Event-ID': '0'})
+
+    assert subscriber.next_message()['event'] == 'ready'
+    resync = subscriber.next_message()
+    assert resync['event'] == 'resync'
+    assert 'id' not in resync
+
+
+def test_rolled_back_writes_publish_nothing(client, tree, broker):
+    position = broker.position()
+    response = client.post('/files/batch', json={'operations': [
+        {'op': 'update', 'file_id': tree['a'], 'feature': 'file_type', 'value': 'x'},
+        {'op': 'delete', 'file_id': 999},
+    ]})
+
+    assert response.status_code == 400
+    assert broker.position() == position
+
+
+def test_last_event_id_must_be_a_version(client):
+    assert client.get('/files/stream', headers={'Last-Event-ID': 'x'}).status_code == 400
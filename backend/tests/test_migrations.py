@@ -0,0 +1,149 @@
+import pytest
+from flask_migrate import downgrade, upgrade
+from sqlalchemy import inspect, text
+
+from app import create_app
+from conftest import assert_tree_consistent
+from models import db
+from routes import tree_cache
+from startup import UnknownSchema, apply_migrations, detect_revision, prepare_database
+
+HEAD = '0006'
+
+BASELINE_COLUMNS = (
+    'file_id', 'file_name', 'file_type', 'file_path', 'disability', 'visibility', 'favorite',
+    'file_content', 'mother_file', 'mother_file_id', 'row_number',
+)
+# Rows as the app wrote them before migrations: string flags, inline contents, no tree index
+BASELINE_ROWS = [
+    (1, 'r', 'mother', '/r', 'true', 'true', 'false', 'hello root', '', None, 1),
+    (2, 'c', 'content', '/r/c', 'false', 'false', 'true', '', 'r', 1, 2),
+    (3, 'd', 'content', '/r/c/d', 'false', 'true', 'true', 'hello root', 'c', 2, 3),
+]
+
+
+@pytest.fixture
+def bare_app(tmp_path):
+    """App on an empty SQLite database that startup has not prepared"""
+    app = create_app()
+    app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'tree.db'}")
+    tree_cache._entries.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def insert_baseline_rows(app):
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(
+            text(
+                f"INSERT INTO files ({', '.join(BASELINE_COLUMNS)}) "
+                f"VALUES ({', '.join(f':{column}' for column in BASELINE_COLUMNS)})"
+            ),
+            [dict(zip(BASELINE_COLUMNS, row)) for row in BASELINE_ROWS],
+        )
+
+
+def current_revision(app):
+    with app.app_context(), db.engine.connect() as connection:
+        return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+
+
+def test_fresh_database_is_migrated_to_head(bare_app):
+    client = bare_app.test_client()
+    assert client.get('/health/ready').status_code == 503
+
+    prepare_database(bare_app)
+
+    assert current_revision(bare_app) == HEAD
+    assert client.get('/health/ready').status_code == 200
+    # A second start finds the schema current
+    with bare_app.app_context():
+        assert apply_migrations() is False
+
+
+def test_baseline_data_survives_the_upgrade(bare_app):
+    with bare_app.app_context():
+        upgrade(revision='0001')
+    insert_baseline_rows(bare_app)
+
+    prepare_database(bare_app)
+
+    client = bare_app.test_client()
+    tree = client.get('/files').get_json()['files']
+    assert [root['file_id'] for root in tree] == [1]
+    child = tree[0]['children'][0]
+    assert (child['file_id'], child['visibility'], child['favorite']) == (2, 'false', 'true')
+    assert child['children'][0]['file_id'] == 3
+    assert client.get('/files/1/content').get_json()['file_content'] == 'hello root'
+    assert client.get('/files/3/content').get_json()['file_content'] == 'hello root'
+    # Identical bodies are stored once
+    with bare_app.app_context():
+        assert db.session.execute(text('SELECT count(*) FROM content_blobs')).scalar() == 1
+    assert_tree_consistent(bare_app)
+
+
+def test_downgrade_to_baseline_keeps_rows(bare_app):
+    with bare_app.app_context():
+        upgrade(revision='0001')
+    insert_baseline_rows(bare_app)
+    prepare_database(bare_app)
+
+    with bare_app.app_context():
+        downgrade(revision='0001')
+        rows = db.session.execute(text(f"SELECT {', '.join(BASELINE_COLUMNS)} FROM files ORDER BY file_id")).all()
+    assert [tuple(row) for row in rows] == BASELINE_ROWS
+
+
+def test_unversioned_baseline_schema_is_stamped_and_upgraded(bare_app):
+    with bare_app.app_context():
+        upgrade(revision='0001')
+    insert_baseline_rows(bare_app)
+    with bare_app.app_context(), db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE alembic_version'))
+        assert detect_revision(connection) == '0001'
+
+    prepare_database(bare_app)
+
+    assert current_revision(bare_app) == HEAD
+    assert_tree_consistent(bare_app)
+
+
+def test_unversioned_create_all_schema_is_stamped_at_head(bare_app):
+    with bare_app.app_context():
+        db.create_all()
+        assert not inspect(db.engine).has_table('alembic_version')
+
+    prepare_database(bare_app)
+
+    assert current_revision(bare_app) == HEAD
+    assert bare_app.test_client().post('/add-mother', json={'items': ['a']}).status_code == 201
+
+
+def test_unversioned_schema_between_revisions_is_refused(bare_app):
+    with bare_app.app_context():
+        upgrade(revision='0001')
+    with bare_app.app_context(), db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE alembic_version'))
+        # What the model of the first tree index commit added, without the change log columns
+        connection.execute(text('ALTER TABLE files ADD COLUMN node_path TEXT'))
+
+    with pytest.raises(UnknownSchema):
+        prepare_database(bare_app)
+    assert bare_app.test_client().get('/health/ready').status_code == 503
+
+
+def test_missing_tree_state_row_is_seeded(bare_app):
+    with bare_app.app_context():
+        upgrade(revision='0005')
+        db.session.execute(text('DELETE FROM tree_state'))
+        db.session.commit()
+
+    prepare_database(bare_app)
+
+    with bare_app.app_context():
+        assert db.session.execute(text('SELECT id, version, pruned_version FROM tree_state')).all() == [(1, 0, 0)]
+    client = bare_app.test_client()
+    assert client.post('/add-mother', json={'items': ['a']}).status_code == 201
+    assert client.get('/files/changes?since=0').get_json()['version'] == 1
@@ -0,0 +1,87 @@
+import pytest
+
+from conftest import add_child, add_roots
+from routes.ordering import ROW_GAP
+
+
+def order(client, parent_id):
+    files = client.get(f'/files/{parent_id}/children').get_json()['files']
+    return [file['file_name'] for file in files]
+
+
+def row_numbers(client, parent_id):
+    files = client.get(f'/files/{parent_id}/children').get_json()['files']
+    return [file['row_number'] for file in files]
+
+
+@pytest.fixture
+def siblings(client):
+    """A root with children x0..x4, ids by name"""
+    parent = add_roots(client, 'p')[0]
+    ids = {f'x{index}': add_child(client, parent, f'x{index}') for index in range(5)}
+    ids['p'] = parent
+    return ids
+
+
+def move(client, file_id, side, target_id):
+    return client.post(f'/files/{file_id}/move-{side}', json={'target_id': target_id})
+
+
+def test_new_files_are_appended_ROW_GAP_apart(client, siblings):
+    assert row_numbers(client, siblings['p']) == [ROW_GAP * (index + 1) for index in range(5)]
+
+
+def test_move_before_and_after(client, siblings):
+    assert move(client, siblings['x4'], 'before', siblings['x0']).status_code == 200
+    assert order(client, siblings['p']) == ['x4', 'x0', 'x1', 'x2', 'x3']
+
+    assert move(client, siblings['x0'], 'after', siblings['x3']).status_code == 200
+    assert order(client, siblings['p']) == ['x4', 'x1', 'x2', 'x3', 'x0']
+
+    # Only the moved file is written: x4 went to 0, x1 is still at 2 * ROW_GAP
+    response = move(client, siblings['x2'], 'after', siblings['x4'])
+    assert response.get_json()['row_number'] == ROW_GAP
+    assert order(client, siblings['p']) == ['x4', 'x2', 'x1', 'x3', 'x0']
+
+
+def test_exhausted_gap_rebalances_the_siblings(client, siblings):
+    # Each move halves the gap between x0 and the file moved last, until there is no room left
+    for step in range(12):
+        name = 'x2' if step % 2 else 'x3'
+        assert move(client, siblings[name], 'after', siblings['x0']).status_code == 200
+
+    assert order(client, siblings['p']) == ['x0', 'x2', 'x3', 'x1', 'x4']
+    numbers = row_numbers(client, siblings['p'])
+    assert numbers == sorted(numbers)
+    assert len(set(numbers)) == 5
+    assert min(later - earlier for earlier, later in zip(numbers, numbers[1:])) >= 1
+
+
+def test_tied_row_numbers_are_rebalanced(client, siblings):
+    client.post('/update-files-order', json={'files': [
+        {'file_id': siblings[name], 'row_number': 7} for name in ('x0', 'x1', 'x2')
+    ]})
+
+    assert move(client, siblings['x4'], 'after', siblings['x1']).status_code == 200
+    names = order(client, siblings['p'])
+    assert names.index('x4') == names.index('x1') + 1
+    assert len(set(row_numbers(client, siblings['p']))) == 5
+
+
+def test_bulk_reorder(client, siblings):
+    new_order = ['x3', 'x1', 'x4', 'x0', 'x2']
+    response = client.post('/update-files-order', json={'files': [
+        {'file_id': siblings[name], 'row_number': (index + 1) * 10} for index, name in enumerate(new_order)
+    ]})
+
+    assert response.status_code == 200
+    assert order(client, siblings['p']) == new_order
+
+
+@pytest.mark.parametrize('target, status', [('x0', 400), ('other', 400), (None, 400), ('missing', 404)])
+def test_invalid_moves(client, siblings, target, status):
+    other = add_roots(client, 'q')[0]
+    target_id = {'x0': siblings['x0'], 'other': other, None: None, 'missing': 999}[target]
+
+    assert move(client, siblings['x0'], 'before', target_id).status_code == status
+    assert order(client, siblings['p']) == ['x0', 'x1', 'x2', 'x3', 'x4']
@@ -0,0 +1,44 @@
+import pytest
+
+from conftest import add_child
+
+
+@pytest.fixture
+def flagged_tree(client, tree):
+    """The tree fixture with a few flags changed and a name full of LIKE wildcards"""
+    client.post('/file-update/favorite', json={'file_id': tree['d'], 'favorite': 'true'})
+    client.post('/file-update/visibility', json={'file_id': tree['c'], 'visibility': 'false'})
+    tree['h'] = add_child(client, tree['g'], 'a%_ünï', 'body of h')
+    return tree
+
+
+@pytest.mark.parametrize('url', [
+    '/files',
+    '/files?fields=file_name',
+    '/files/favorites',
+    '/files/visible',
+    '/files/filter?favorite=true',
+    '/files/filter?visibility=false&name=f',
+    '/search_files?query=a',
+    '/search_files?query=a%25_',
+    '/search_files?query=b&content=1',
+    '/search_files?query=a&mode=prefix&fields=file_name',
+    '/search_files?query=a&limit=1',
+])
+@pytest.mark.parametrize('debug', [False, True])
+def test_streamed_body_matches_buffered(app, client, flagged_tree, url, debug):
+    # jsonify indents in debug mode; these bodies must not
+    app.debug = debug
+    separator = '&' if '?' in url else '?'
+    buffered = client.get(url)
+    streamed = client.get(f'{url}{separator}stream=1')
+
+    assert buffered.status_code == streamed.status_code == 200
+    assert streamed.is_streamed
+    assert streamed.data == buffered.data
+    assert streamed.headers.get('X-Next-Cursor') == buffered.headers.get('X-Next-Cursor')
+
+
+def test_search_escapes_wildcards(client, flagged_tree):
+    names = [hit['file_name'] for hit in client.get('/search_files?query=a%25_&stream=1').get_json()]
+    assert names == ['a%_ünï']
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import add_child
+from routes import tree_cache
+
+
+def test_projections_and_filters_do_not_grow_the_cache(client, tree):
+    for name in 'abcdefg':
+        assert client.get(f'/files/filter?name={name}').status_code == 200
+        assert client.get(f'/files/filter?name={name}&fields=file_name').status_code == 200
+    for fields in ('file_name', 'file_type', 'file_name,favorite'):
+        assert client.get(f'/files?fields={fields}').status_code == 200
+
+    assert set(tree_cache._entries) == {'files', 'filter'}
+
+
+def test_projection_is_cut_from_the_cached_tree(client, tree):
+    projected = client.get('/files?fields=file_name').get_json()['files']
+
+    assert [root['file_name'] for root in projected] == ['a', 'g']
+    assert set(projected[0]) == {'file_id', 'mother_file_id', 'file_name', 'children'}
+    assert [child['file_name'] for child in projected[0]['children']] == ['b', 'c']
+    # The cached tree itself keeps every field
+    assert 'file_type' in tree_cache._entries['files'].tree[0]
+
+
+@pytest.mark.parametrize('url', ['/files', '/files?fields=file_name', '/files/favorites', '/files/filter?name=d'])
+def test_etag_answers_304_until_a_write(client, tree, url):
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    unchanged = client.get(url, headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b''
+
+    add_child(client, tree['b'], 'dd')
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert client.get(url, headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+
+def test_write_invalidates_the_cached_body(client, tree):
+    client.get('/files')
+    client.post('/file-update/favorite', json={'file_id': tree['d'], 'favorite': 'true'})
+
+    favorites = client.get('/files/favorites').get_json()['files']
+    assert [root['file_name'] for root in favorites] == ['a']
+    assert favorites[0]['children'][0]['children'][0]['favorite'] == 'true'
+
+
+def test_etags_differ_between_views_and_projections(client, tree):
+    etags = {client.get(url).headers['ETag'] for url in (
+        '/files', '/files?fields=file_name', '/files/favorites', '/files/visible',
+        '/files/filter?name=d', '/files/filter?name=e',
+    )}
+    assert len(etags) == 6
@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from conftest import add_child, add_roots
+from models import File
+
+
+def files_by_id(app):
+    with app.app_context():
+        return {file.file_id: file._fields_dict() | {'node_path': file.node_path} for file in File.query}
+
+
+@pytest.mark.parametrize('flag', ['visibility', 'favorite', 'disability'])
+def test_cascade_sets_flag_on_whole_subtree(app, client, tree, check_tree, flag):
+    before = files_by_id(app)
+    value = 'false' if before[tree['b']][flag] == 'true' else 'true'
+
+    response = client.post(f'/file-update/{flag}', json={'file_id': tree['b'], flag: value})
+
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 3
+    after = files_by_id(app)
+    for name in 'bde':
+        assert after[tree[name]][flag] == value
+    for name in 'acfg':
+        assert after[tree[name]][flag] == before[tree[name]][flag]
+    check_tree()
+
+
+def test_cascade_unknown_file(client, tree):
+    response = client.post('/file-update/favorite', json={'file_id': 999, 'favorite': 'true'})
+    assert response.status_code == 404
+
+
+def test_delete_removes_subtree(app, client, tree, check_tree):
+    response = client.delete('/delete-file', json={'file_id': tree['b']})
+
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] == 3
+    assert set(files_by_id(app)) == {tree[name] for name in 'acfg'}
+    check_tree()
+
+
+def test_delete_unknown_file(client, tree):
+    assert client.delete('/delete-file', json={'file_id': 999}).status_code == 404
+
+
+def test_move_rewrites_subtree(app, client, tree, check_tree):
+    response = client.post(f"/files/{tree['b']}/move", json={'mother_file_id': tree['c']})
+
+    assert response.status_code == 200
+    assert response.get_json()['moved'] == 3
+    files = files_by_id(app)
+    assert files[tree['b']]['mother_file_id'] == tree['c']
+    assert files[tree['d']]['node_path'] == f"/{tree['a']}/{tree['c']}/{tree['b']}/{tree['d']}/"
+    assert files[tree['d']]['file_path'] == '/a/c/b/d'
+    # Last among its new siblings
+    assert files[tree['b']]['row_number'] > files[tree['f']]['row_number']
+    check_tree()
+
+
+def test_move_to_root(app, client, tree, check_tree):
+    response = client.post(f"/files/{tree['c']}/move", json={'mother_file_id': 0})
+
+    assert response.status_code == 200
+    files = files_by_id(app)
+    assert files[tree['c']]['mother_file_id'] is None
+    assert files[tree['f']]['file_path'] == '/c/f'
+    check_tree()
+
+
+@pytest.mark.parametrize('name, target', [('a', 'a'), ('a', 'b'), ('b', 'd')])
+def test_move_under_itself_is_rejected(app, client, tree, check_tree, name, target):
+    before = files_by_id(app)
+
+    response = client.post(f"/files/{tree[name]}/move", json={'mother_file_id': tree[target]})
+
+    assert response.status_code == 400
+    assert files_by_id(app) == before
+    check_tree()
+
+
+def test_random_mutations_keep_the_tree_consistent(app, client, check_tree):
+    """Node paths and subtree aggregates stay right through a random mix of writes"""
+    rng = random.Random(20)
+    ids = add_roots(client, 'r0', 'r1')
+    for step in range(200):
+        op = rng.choice(['add', 'add', 'delete', 'move', 'flag'])
+        target = rng.choice(ids)
+        if op == 'add':
+            ids.append(add_child(client, target, f'n{step}'))
+        elif op == 'delete' and len(ids) > 3:
+            client.delete('/delete-file', json={'file_id': target})
+        elif op == 'move':
+            parent = rng.choice(ids + [0])
+            response = client.post(f'/files/{target}/move', json={'mother_file_id': parent})
+            assert response.status_code in (200, 400)
+        elif op == 'flag':
+            flag = rng.choice(['visibility', 'favorite', 'disability'])
+            client.post(f'/file-update/{flag}', json={'file_id': target, flag: rng.choice(['true', 'false'])})
+        ids = list(files_by_id(app))
+        if not ids:
+            ids = add_roots(client, f'r{step}')
+        if step % 25 == 24:
+            check_tree()
+
+
+def test_rename_rewrites_subtree_file_paths(app, client, tree, check_tree):
+    response = client.post('/file-update/file_name', json={'file_id': tree['b'], 'file_name': 'b2'})
+
+    assert response.status_code == 200
+    files = files_by_id(app)
+    assert [files[tree[name]]['file_path'] for name in 'bde'] == ['/a/b2', '/a/b2/d', '/a/b2/e']
+    assert files[tree['f']]['file_path'] == '/a/c/f'
+    check_tree()
+
+
+def test_batch_renames_of_nested_files_compose(app, client, tree, check_tree):
+    response = client.post('/files/batch', json={'operations': [
+        {'op': 'update', 'file_id': tree['d'], 'feature': 'file_name', 'value': 'd2'},
+        {'op': 'update', 'file_id': tree['a'], 'feature': 'file_name', 'value': 'a2'},
+    ]})
+
+    assert response.status_code == 200, response.data
+    files = files_by_id(app)
+    assert [files[tree[name]]['file_path'] for name in 'abdf'] == ['/a2', '/a2/b', '/a2/b/d2', '/a2/c/f']
+    check_tree()
+
+
+def test_file_path_is_not_writable(client, tree):
+    assert client.post('/file-update/file_path', json={'file_id': tree['b'], 'file_path': '/x'}).status_code == 400
+    response = client.post('/files/batch', json={'operations': [
+        {'op': 'update', 'file_id': tree['b'], 'feature': 'file_path', 'value': '/x'},
+    ]})
+    assert response.status_code == 400
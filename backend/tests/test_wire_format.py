@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from routes.wire_format import FLAG_BITS, MIMETYPES
+
+
+def rebuild(document):
+    """Nest a columnar document back into {file_id: (parent, name, flags)} and the root ids"""
+    columns = document['columns']
+    ids = set(columns['file_id'])
+    nodes, roots = {}, []
+    for index, file_id in enumerate(columns['file_id']):
+        parent = columns['mother_file_id'][index]
+        nodes[file_id] = (parent if parent in ids else None, columns['file_name'][index], columns['flags'][index])
+        if parent not in ids:
+            roots.append(file_id)
+    return nodes, roots
+
+
+def flatten(tree):
+    nodes, stack = {}, list(tree)
+    while stack:
+        node = stack.pop()
+        flags = sum(bit for name, bit in FLAG_BITS if node[name] == 'true')
+        nodes[node['file_id']] = (node['mother_file_id'], node['file_name'], flags)
+        stack.extend(node['children'])
+    return nodes
+
+
+def test_columnar_tree_matches_json(client, tree):
+    client.post('/file-update/favorite', json={'file_id': tree['b'], 'favorite': 'true'})
+    expected = client.get('/files').get_json()['files']
+
+    response = client.get('/files?format=columnar')
+
+    assert response.status_code == 200
+    assert response.mimetype == MIMETYPES['columnar']
+    document = json.loads(response.data)
+    assert document['count'] == 7
+    nodes, roots = rebuild(document)
+    assert nodes == flatten(expected)
+    assert roots == [tree['a'], tree['g']]
+    # Depth first: a node comes right before its first child
+    assert document['columns']['file_name'] == list('abdecfg')
+
+
+def test_accept_header_selects_the_format(client, tree):
+    response = client.get('/files', headers={'Accept': MIMETYPES['columnar']})
+    assert response.mimetype == MIMETYPES['columnar']
+    assert 'Accept' in response.headers['Vary']
+    assert client.get('/files', headers={'Accept': 'application/json'}).mimetype == 'application/json'
+
+
+def test_msgpack_carries_the_columnar_document(client, tree):
+    msgpack = pytest.importorskip('msgpack')
+    columnar = json.loads(client.get('/files?format=columnar').data)
+
+    response = client.get('/files?format=msgpack')
+
+    assert response.mimetype == MIMETYPES['msgpack']
+    assert msgpack.unpackb(response.data) == columnar
+
+
+def test_children_slice_keeps_counts(client, tree):
+    document = json.loads(client.get(f"/files/{tree['a']}/children?format=columnar").data)
+    assert document['columns']['file_name'] == ['b', 'c']
+    assert document['columns']['child_count'] == [2, 1]
+
+
+def test_formats_have_their_own_etags(client, tree):
+    etags = {client.get(f'/files?format={fmt}').headers['ETag'] for fmt in ('json', 'columnar')}
+    assert len(etags) == 2
+
+
+def test_unknown_format_is_refused(client, tree):
+    assert client.get('/files?format=xml').status_code == 406
+    assert client.get(f"/files/{tree['a']}/children?format=xml").status_code == 406